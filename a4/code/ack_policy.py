@@ -0,0 +1,62 @@
+class AckPolicy:
+    """
+    Decides when the client sends a cumulative ACK. In order packets are ACKed
+    every `ack_every` packets or once `ack_delay` seconds passed since the first
+    unacked one, out of order packets and gap fills are always ACKed at once.
+    In adaptive mode `ack_every` follows the observed arrival rate so that roughly
+    one ACK is sent per `ack_delay` at high rates and one per packet at low rates.
+    """
+
+    # Upper bound for the adaptive mode, the sender still needs a steady ACK clock
+    MAX_ACK_EVERY = 8
+    # Gain of the inter-arrival time moving average
+    EWMA_GAIN = 0.125
+
+    def __init__(self, ack_every=1, ack_delay=0.04, adaptive=False):
+        self.ack_every = max(1, ack_every)
+        self.ack_delay = ack_delay
+        self.adaptive = adaptive
+        # In order packets received since the last ACK
+        self.unacked_count = 0
+        # Time by which the pending ACK has to go out, None when nothing is pending
+        self.ack_deadline = None
+        self.last_arrival = None
+        self.inter_arrival = None
+
+    def on_arrival(self, now):
+        if self.last_arrival is not None:
+            sample = now - self.last_arrival
+            if self.inter_arrival is None:
+                self.inter_arrival = sample
+            else:
+                self.inter_arrival += self.EWMA_GAIN * (sample - self.inter_arrival)
+        self.last_arrival = now
+        if self.adaptive and self.inter_arrival:
+            arrival_rate = 1 / self.inter_arrival
+            self.ack_every = max(
+                1, min(self.MAX_ACK_EVERY, int(arrival_rate * self.ack_delay))
+            )
+
+    def on_in_order(self, now):
+        """
+        Count an in order packet, returns True when the ACK should be sent now.
+        """
+        self.unacked_count += 1
+        if self.unacked_count >= self.ack_every:
+            return True
+        if self.ack_deadline is None:
+            self.ack_deadline = now + self.ack_delay
+        return False
+
+    def on_ack_sent(self):
+        self.unacked_count = 0
+        self.ack_deadline = None
+
+    def is_pending(self):
+        return self.ack_deadline is not None
+
+    def get_wait(self, idle_timeout, now):
+        # How long the receive loop may block before the pending ACK is due
+        if self.ack_deadline is None:
+            return idle_timeout
+        return max(0.0001, min(idle_timeout, self.ack_deadline - now))
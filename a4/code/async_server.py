@@ -0,0 +1,617 @@
+import argparse
+import asyncio
+import bisect
+import logging
+import multiprocessing
+import queue
+import socket
+import time
+from utils import make_reply, make_error, parse_request
+from timers import RetransmissionTimer
+from batch_io import BatchIO
+from wire import is_get, parse_request_packet
+from catalog import Catalog
+from rtt import RttEstimator
+from cache import CACHE_POLICIES, ChunkCache, ChunkReader, get_hit_rate
+from tracing import configure_logging, LOG_LEVELS
+
+SERVER_FILE_PATH = "./test/test_10MB.bin"
+# Seconds between the statistics reports of the workers
+STATS_INTERVAL = 1.0
+# Default size of the hot chunks tracked for the sessions of a worker (in MB)
+CACHE_SIZE = 64
+
+log = logging.getLogger("async_server")
+
+
+class Session:
+    """
+    One download served by the async server. Window, RTO and congestion control
+    state live here so every client is paced independently of the others.
+    """
+
+    # Maximum Segment Size for each packet (in bytes)
+    MSS = 1400
+
+    # Threshold for duplicate ACKs to trigger fast recovery
+    DUP_ACK_THRESHOLD = 3
+    # Initial timeout value, updated as ACK packets arrive
+    INITIAL_TIMEOUT = 1.0
+    # Bounds of the timeout (RFC 6298)
+    MIN_TIMEOUT = 0.2
+    MAX_TIMEOUT = 60.0
+    # Consecutive timeouts without progress before the client is given up
+    RETRY_BEFORE_QUIT = 10
+    # Congestion window and slow start threshold are counted in packets
+    INITIAL_CWND = 1
+    INITIAL_SSTHRESH = 64000 // MSS
+
+    def __init__(self, server, client_address, options, wire, served_file):
+        self.server = server
+        self.loop = server.loop
+        self.client_address = client_address
+        self.options = options
+        # Packet format of the client, told by its GET
+        self.wire = wire
+        self.served_file = served_file
+        # Segments are read through the chunk cache shared with the other sessions
+        self.reader = ChunkReader(server.cache, served_file)
+        self.range_start, self.range_end = self.get_range(
+            served_file.size, options.get("range")
+        )
+        self.num_segments = (self.range_end - self.range_start + self.MSS - 1) // self.MSS
+        # Segment ranges a resumed download still needs, None sends everything
+        self.needed = self.get_needed_ranges(options)
+
+        # RTT Variables
+        self.rtt_estimator = RttEstimator(
+            self.INITIAL_TIMEOUT, self.MIN_TIMEOUT, self.MAX_TIMEOUT
+        )
+        self.timeout_interval = self.rtt_estimator.rto
+        # Window
+        self.LAF = -1
+        self.LFS = -1
+        self.packet_timestamps = {}
+        self.retransmitted = set()
+        self.sacked = set()
+        self.highest_sacked = -1
+        self.acked_upto = -1
+        self.retransmission_timer = RetransmissionTimer()
+        self.timer_handle = None
+        # Congestion control
+        self.state = "SS"
+        self.cwnd = self.INITIAL_CWND
+        self.ssthresh = self.INITIAL_SSTHRESH
+        self.last_ack = -1
+        self.dup_ack_count = 0
+        # Handshake / teardown
+        self.phase = "META" if options else "DATA"
+        self.retries = 0
+        self.start_time = time.time()
+        # Statistics
+        self.packets_sent = 0
+        self.retransmissions = 0
+
+    def get_range(self, file_size, byte_range):
+        # "range=start-end" serves bytes start..end-1, seqs count from the range start
+        if not byte_range:
+            return 0, file_size
+        start, _, end = byte_range.partition("-")
+        start = min(int(start), file_size)
+        end = file_size if not end else min(int(end), file_size)
+        return start, max(start, end)
+
+    def get_needed_ranges(self, options):
+        # "need=a-b,c-d" lists the [start, end) segments a resumed download is
+        # missing, it only holds if the client saw the same file and segment size
+        need = options.get("need")
+        if (
+            need is None
+            or options.get("digest") != self.served_file.get_digest()
+            or options.get("mss") != str(self.MSS)
+        ):
+            return None
+        ranges = []
+        for token in need.split(","):
+            if not token:
+                continue
+            start, _, end = token.partition("-")
+            start, end = int(start), min(int(end), self.num_segments)
+            if start < end:
+                ranges.append((start, end))
+        ranges.sort()
+        self.needed_starts = [start for start, _ in ranges]
+        return ranges
+
+    def next_needed(self, seq):
+        # First segment at or after `seq` the client asked for, num_segments if none
+        if self.needed is None:
+            return seq
+        i = bisect.bisect_right(self.needed_starts, seq) - 1
+        if i >= 0 and seq < self.needed[i][1]:
+            return seq
+        if i + 1 < len(self.needed):
+            return self.needed[i + 1][0]
+        return self.num_segments
+
+    def start(self):
+        if self.phase == "META":
+            self.send_metadata()
+        else:
+            self.send_new_packets()
+
+    def send_metadata(self):
+        # The client confirms the metadata with ACK 0
+        reply = make_reply(
+            {
+                "size": self.range_end - self.range_start,
+                "mss": self.MSS,
+                "digest": self.served_file.get_digest(),
+            }
+        )
+        self.server.transport.sendto(reply, self.client_address)
+        self.arm_phase_timer()
+
+    def on_get(self):
+        # A repeated GET during the handshake means our metadata reply was lost,
+        # past it the client started the download over
+        if self.phase == "META":
+            self.send_metadata()
+            return True
+        return False
+
+    def arm_phase_timer(self):
+        # A single timer guards the handshake and the EOF exchange
+        self.retransmission_timer.arm(-1, self.loop.time() + self.timeout_interval)
+        self.schedule_timer()
+
+    def schedule_timer(self):
+        deadline = self.retransmission_timer.next_deadline()
+        if self.timer_handle is not None:
+            if deadline is not None and self.timer_handle.when() == deadline:
+                return
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        if deadline is not None:
+            self.timer_handle = self.loop.call_at(deadline, self.on_timer)
+
+    def get_segment(self, seq):
+        offset = self.range_start + seq * self.MSS
+        return self.reader.read(offset, min(self.MSS, self.range_end - offset))
+
+    def send_segments(self, seqs, retrans_packet=False):
+        now = self.loop.time()
+        packets = []
+        for seq in seqs:
+            segment = self.get_segment(seq)
+            packets.append([self.wire.make_data_header(seq, segment), segment])
+        self.server.send_packets(packets, self.client_address)
+        for seq in seqs:
+            self.packet_timestamps[seq] = now
+            self.retransmission_timer.arm(seq, now + self.timeout_interval)
+            if retrans_packet:
+                self.retransmitted.add(seq)
+        self.packets_sent += len(seqs)
+        if retrans_packet:
+            self.retransmissions += len(seqs)
+
+    def send_new_packets(self):
+        # The window counts packets in flight, segments a resumed client already
+        # has are skipped
+        seqs = []
+        seq = self.next_needed(self.LFS + 1)
+        while seq < self.num_segments and len(self.packet_timestamps) + len(seqs) < int(self.cwnd):
+            seqs.append(seq)
+            seq = self.next_needed(seq + 1)
+        if seqs:
+            self.send_segments(seqs)
+            self.LFS = seqs[-1]
+        if self.next_needed(self.LAF + 1) == self.num_segments:
+            self.phase = "EOF"
+            self.retries = 0
+            self.send_eof()
+        self.schedule_timer()
+
+    def send_eof(self):
+        eof_packet = self.wire.make_eof(self.num_segments)
+        self.server.transport.sendto(eof_packet, self.client_address)
+        self.arm_phase_timer()
+
+    def update_time_interval(self, seq):
+        now = self.loop.time()
+        self.rtt_estimator.on_sample(now - self.packet_timestamps[seq], now)
+        self.timeout_interval = self.rtt_estimator.rto
+
+    def on_ack(self, ack_num, sack_blocks):
+        if self.phase == "META":
+            self.retransmission_timer.cancel(-1)
+            self.phase = "DATA"
+            self.send_new_packets()
+            return
+        if self.phase == "EOF":
+            if ack_num == self.num_segments + 1:
+                self.finish(True)
+            return
+        if ack_num > self.next_needed(self.LFS + 1):
+            return
+        if self.server.sack:
+            self.record_sack_blocks(sack_blocks)
+        if ack_num > self.LAF + 1:
+            # Only packets sent once give an unambiguous RTT sample
+            if ack_num - 1 in self.packet_timestamps and ack_num - 1 not in self.retransmitted:
+                self.update_time_interval(ack_num - 1)
+            self.LAF = ack_num - 1
+            self.retries = 0
+            self.on_new_ack(self.drop_acked())
+        elif ack_num == self.last_ack:
+            self.on_dup_ack(ack_num)
+        self.last_ack = ack_num
+        self.send_new_packets()
+
+    def on_new_ack(self, newly_acked):
+        self.dup_ack_count = 0
+        if self.state == "FR":
+            # Exit fast recovery on new ACK
+            self.cwnd = self.ssthresh
+            self.state = "CA"
+        elif self.state == "SS":
+            self.cwnd += newly_acked
+            if self.cwnd >= self.ssthresh:
+                self.state = "CA"
+        else:
+            self.cwnd += newly_acked / self.cwnd
+
+    def on_dup_ack(self, ack_num):
+        self.dup_ack_count += 1
+        if self.dup_ack_count == self.DUP_ACK_THRESHOLD and self.state != "FR":
+            self.ssthresh = max(self.cwnd / 2, 2)
+            self.cwnd = self.ssthresh + self.DUP_ACK_THRESHOLD
+            self.state = "FR"
+            if self.server.sack and self.highest_sacked > ack_num:
+                holes = [
+                    seq
+                    for seq in range(ack_num, self.highest_sacked)
+                    if seq not in self.sacked and self.next_needed(seq) == seq
+                ]
+            else:
+                holes = [ack_num]
+            self.send_segments(holes, retrans_packet=True)
+        elif self.state == "FR":
+            self.cwnd += 1
+
+    def record_sack_blocks(self, sack_blocks):
+        for start, end in sack_blocks:
+            for seq in range(max(start, self.LAF + 1), min(end, self.LFS + 1)):
+                self.sacked.add(seq)
+                self.retransmission_timer.cancel(seq)
+                self.highest_sacked = max(self.highest_sacked, seq)
+
+    def drop_acked(self):
+        # Returns the number of packets the cumulative ACK took out of flight
+        newly_acked = 0
+        for seq in range(self.acked_upto + 1, self.LAF + 1):
+            if self.packet_timestamps.pop(seq, None) is not None:
+                newly_acked += 1
+            self.retransmitted.discard(seq)
+            self.sacked.discard(seq)
+            self.retransmission_timer.cancel(seq)
+        self.acked_upto = max(self.acked_upto, self.LAF)
+        return newly_acked
+
+    def on_timer(self):
+        self.timer_handle = None
+        expired = self.retransmission_timer.pop_expired(self.loop.time())
+        if self.phase == "DATA":
+            # Timers of acked or sacked packets may still be armed
+            expired = [
+                seq
+                for seq in expired
+                if self.LAF < seq <= self.LFS and seq not in self.sacked
+            ]
+        if not expired:
+            self.schedule_timer()
+            return
+        # The packets of a flight expire one after the other, only the oldest
+        # outstanding one backs off and counts towards giving up
+        if self.phase != "DATA" or self.next_needed(self.LAF + 1) in expired:
+            self.retries += 1
+            if self.retries > self.RETRY_BEFORE_QUIT:
+                # EOF that was never acknowledged still counts as delivered data
+                self.finish(self.phase == "EOF")
+                return
+            # Back off until the next RTT sample
+            self.rtt_estimator.on_timeout()
+            self.timeout_interval = self.rtt_estimator.rto
+            if self.phase == "DATA":
+                self.ssthresh = max(self.cwnd / 2, 2)
+                self.cwnd = self.INITIAL_CWND
+                self.state = "SS"
+                self.dup_ack_count = 0
+        if self.phase == "META":
+            self.send_metadata()
+            return
+        if self.phase == "EOF":
+            self.send_eof()
+            return
+        self.send_segments(expired, retrans_packet=True)
+        self.schedule_timer()
+
+    def finish(self, delivered):
+        if self.timer_handle is not None:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+        self.server.end_session(self, delivered)
+
+
+class FileServerProtocol(asyncio.DatagramProtocol):
+    """
+    Serves the files of the catalog to every client that sends a GET, keeping
+    one Session per client address. File data comes from the catalog's
+    mappings through one chunk cache shared by all sessions.
+    """
+
+    # Buffer size for receiving packets
+    BUFFER_SIZE = 1000
+    # Datagrams moved per sendmmsg call
+    BATCH_SIZE = 64
+
+    def __init__(self, loop, catalog, cache, sack):
+        self.loop = loop
+        self.catalog = catalog
+        self.cache = cache
+        self.sack = sack
+        self.sessions = {}
+        self.transport = None
+        self.batch_io = None
+        # Statistics
+        self.client_count = 0
+        self.failed_count = 0
+        self.packets_sent = 0
+        self.retransmissions = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.batch_io = BatchIO(
+            transport.get_extra_info("socket"), self.BATCH_SIZE, self.BUFFER_SIZE
+        )
+
+    def send_packets(self, packets, address):
+        # sendmmsg when available, the transport queues whatever the kernel refused
+        self.batch_io.send_batch(packets, address, self.send_through_transport)
+
+    def send_through_transport(self, buffers, address):
+        self.transport.sendto(b"".join(buffers), address)
+
+    def datagram_received(self, data, address):
+        session = self.sessions.get(address)
+        if data.startswith(b"STAT"):
+            # File and segment size for clients splitting the file into ranges
+            _, options = parse_request(data)
+            served_file = self.catalog.open(options.get("file"))
+            if served_file is None:
+                self.transport.sendto(make_error("not_found"), address)
+                return
+            reply = make_reply({"size": served_file.size, "mss": Session.MSS})
+            self.transport.sendto(reply, address)
+            return
+        if is_get(data):
+            if session is not None:
+                if session.on_get():
+                    return
+                log.info(f"Client {address[0]}:{address[1]} restarted its download")
+                session.finish(False)
+            command, options, wire = parse_request_packet(data)
+            log.info(f"Client connected on \t{address[0]}:{address[1]}")
+            served_file = self.catalog.open(options.get("file"))
+            if served_file is None:
+                log.warning(f"Requested file {options.get('file')} is not served")
+                self.transport.sendto(make_error("not_found"), address)
+                return
+            session = Session(self, address, options, wire, served_file)
+            self.sessions[address] = session
+            session.start()
+            return
+        if session is None:
+            return
+        parsed = session.wire.parse_ack(data)
+        if parsed is None:
+            return
+        ack_num, sack_blocks, _ = parsed
+        session.on_ack(ack_num, sack_blocks)
+
+    def get_stats(self):
+        # Totals of the finished sessions plus the ones still running
+        return {
+            **self.cache.get_stats(),
+            "clients": self.client_count,
+            "failed": self.failed_count,
+            "active": len(self.sessions),
+            "packets_sent": self.packets_sent
+            + sum(session.packets_sent for session in self.sessions.values()),
+            "retransmissions": self.retransmissions
+            + sum(session.retransmissions for session in self.sessions.values()),
+        }
+
+    def end_session(self, session, delivered):
+        self.sessions.pop(session.client_address, None)
+        self.packets_sent += session.packets_sent
+        self.retransmissions += session.retransmissions
+        address = session.client_address
+        if delivered:
+            self.client_count += 1
+            log.info(
+                f"File sent to {address[0]}:{address[1]} in {time.time() - session.start_time:.3f}s, "
+                f"{session.packets_sent} packets, {session.retransmissions} retransmitted, "
+                f"{len(self.sessions)} sessions active"
+            )
+            stats = self.cache.get_stats()
+            log.info(
+                f"Chunk cache: {get_hit_rate(stats):.1%} hits, {stats['cache_evictions']} evictions, "
+                f"{stats['cache_bytes'] // 1024} KB used"
+            )
+        else:
+            self.failed_count += 1
+            log.warning(f"Gave up on {address[0]}:{address[1]}")
+
+
+async def report_stats(protocol, worker_id, stats_queue):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        stats_queue.put((worker_id, protocol.get_stats()))
+
+
+async def serve(
+    server_ip, server_port, sack, catalog, cache, sock=None, worker_id=0, stats_queue=None
+):
+    loop = asyncio.get_running_loop()
+    if sock is None:
+        endpoint = {"local_addr": (server_ip, server_port)}
+    else:
+        endpoint = {"sock": sock}
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: FileServerProtocol(loop, catalog, cache, sack), **endpoint
+    )
+    log.info(f"Server listening on \t{server_ip}:{server_port} (worker {worker_id})")
+    try:
+        if stats_queue is not None:
+            await report_stats(protocol, worker_id, stats_queue)
+        else:
+            # Serve until the process is stopped
+            await asyncio.Event().wait()
+    finally:
+        transport.close()
+
+
+def make_reuseport_socket(server_ip, server_port):
+    # Every worker binds the same port, the kernel hashes clients to workers by 4-tuple
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((server_ip, server_port))
+    return sock
+
+
+def run_worker(worker_id, server_ip, server_port, sack, catalog, cache, stats_queue):
+    sock = make_reuseport_socket(server_ip, server_port)
+    try:
+        asyncio.run(
+            serve(server_ip, server_port, sack, catalog, cache, sock, worker_id, stats_queue)
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(server_ip, server_port, sack, catalog, cache, workers):
+    """
+    Pre-fork `workers` processes that share the port through SO_REUSEPORT and
+    the served files through the catalog's mappings made before the fork, and
+    print the totals they report. Each worker tracks the hot chunks of its own
+    clients, the data itself is held once.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+    # fork keeps the mappings shared instead of pickling them
+    context = multiprocessing.get_context("fork")
+    stats_queue = context.Queue()
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(worker_id, server_ip, server_port, sack, catalog, cache, stats_queue),
+            daemon=True,
+        )
+        for worker_id in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    worker_stats = {}
+    last_totals = None
+    try:
+        while any(process.is_alive() for process in processes):
+            try:
+                worker_id, stats = stats_queue.get(timeout=STATS_INTERVAL)
+            except queue.Empty:
+                continue
+            worker_stats[worker_id] = stats
+            totals = {
+                key: sum(stats[key] for stats in worker_stats.values()) for key in stats
+            }
+            if totals != last_totals:
+                last_totals = totals
+                log.info(
+                    f"{len(worker_stats)} workers: {totals['clients']} clients served, "
+                    f"{totals['failed']} failed, {totals['active']} active, "
+                    f"{totals['packets_sent']} packets, {totals['retransmissions']} retransmitted, "
+                    f"cache {get_hit_rate(totals):.1%} hits, {totals['cache_evictions']} evictions"
+                )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+# Parse command-line arguments
+def read_args():
+    parser = argparse.ArgumentParser(
+        description="Reliable file transfer server over UDP for many concurrent clients."
+    )
+    parser.add_argument("server_ip", help="IP address of the server")
+    parser.add_argument("server_port", type=int, help="Port number of the server")
+    parser.add_argument(
+        "--sack", action="store_true", help="Retransmit only the holes reported by SACK"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes sharing the port with SO_REUSEPORT",
+    )
+    parser.add_argument(
+        "--root", help="Directory of the files clients may ask for by name"
+    )
+    parser.add_argument(
+        "--cache_mb",
+        type=int,
+        default=CACHE_SIZE,
+        help="Size of the hot chunks tracked for the sessions of a worker (in MB)",
+    )
+    parser.add_argument(
+        "--cache_policy",
+        choices=sorted(CACHE_POLICIES),
+        default="arc",
+        help="Replacement policy of the chunk cache",
+    )
+    parser.add_argument(
+        "--log_level",
+        choices=sorted(LOG_LEVELS),
+        default="info",
+        help="Least severe messages that are printed",
+    )
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    return (
+        args.server_ip,
+        args.server_port,
+        args.sack,
+        args.workers,
+        args.root,
+        args.cache_mb,
+        args.cache_policy,
+    )
+
+
+if __name__ == "__main__":
+    # Run the server
+    server_ip, server_port, sack, workers, root, cache_mb, cache_policy = read_args()
+    # Without a name a GET gets SERVER_FILE_PATH
+    catalog = Catalog(root, SERVER_FILE_PATH)
+    catalog.open_all()
+    cache = ChunkCache(cache_mb * 1024 * 1024, cache_policy)
+    try:
+        if workers > 1:
+            run_workers(server_ip, server_port, sack, catalog, cache, workers)
+        else:
+            asyncio.run(serve(server_ip, server_port, sack, catalog, cache))
+    except KeyboardInterrupt:
+        pass
+    log.info(f"Server closed...")
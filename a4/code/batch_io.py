@@ -0,0 +1,209 @@
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+
+# recvmmsg/sendmmsg move a whole batch of datagrams per syscall, they are only
+# used on Linux, everywhere else the same calls fall back to one datagram at a time
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+# Large enough for any sockaddr the kernel hands back
+SOCKADDR_SIZE = 128
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.recvmmsg.argtypes = [
+            ctypes.c_int,
+            ctypes.POINTER(mmsghdr),
+            ctypes.c_uint,
+            ctypes.c_int,
+            ctypes.c_void_p,
+        ]
+        libc.sendmmsg.argtypes = [
+            ctypes.c_int,
+            ctypes.POINTER(mmsghdr),
+            ctypes.c_uint,
+            ctypes.c_int,
+        ]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+LIBC = load_libc()
+
+
+def pack_sockaddr(address):
+    # struct sockaddr_in: family (host order), port (network order), IPv4 address, padding
+    ip, port = address
+    return struct.pack("=H2s4s8x", socket.AF_INET, port.to_bytes(2, "big"), socket.inet_aton(ip))
+
+
+def unpack_sockaddr(raw):
+    family = struct.unpack_from("=H", raw)[0]
+    port = int.from_bytes(raw[2:4], "big")
+    if family == socket.AF_INET6:
+        return (socket.inet_ntop(socket.AF_INET6, raw[8:24]), port)
+    return (socket.inet_ntoa(raw[4:8]), port)
+
+
+def buffer_address(buffer, keep_alive):
+    # Address of the bytes behind `buffer` without copying them when possible,
+    # `keep_alive` holds the ctypes objects until the syscall has returned
+    if isinstance(buffer, bytes):
+        pointer = ctypes.c_char_p(buffer)
+        keep_alive.append(pointer)
+        return ctypes.cast(pointer, ctypes.c_void_p).value
+    view = memoryview(buffer)
+    if view.readonly:
+        # A read-only export has no writable address, copy it once
+        pointer = ctypes.c_char_p(view.tobytes())
+        keep_alive.append(pointer)
+        return ctypes.cast(pointer, ctypes.c_void_p).value
+    array = (ctypes.c_char * view.nbytes).from_buffer(view)
+    keep_alive.append(array)
+    return ctypes.addressof(array)
+
+
+class BatchIO:
+    """
+    Batched datagram I/O on a UDP socket: drains everything that is already queued
+    in the kernel without blocking and sends a list of packets in as few syscalls
+    as possible.
+    """
+
+    def __init__(self, sock, batch_size=64, buffer_size=2048):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.use_mmsg = LIBC is not None and sock.family == socket.AF_INET
+        if self.use_mmsg:
+            # Receive buffers are allocated once and reused for every batch
+            self.recv_buffers = [
+                ctypes.create_string_buffer(buffer_size) for _ in range(batch_size)
+            ]
+            self.recv_names = [
+                ctypes.create_string_buffer(SOCKADDR_SIZE) for _ in range(batch_size)
+            ]
+            self.recv_iovecs = (iovec * batch_size)()
+            self.recv_msgs = (mmsghdr * batch_size)()
+            for i in range(batch_size):
+                self.recv_iovecs[i].iov_base = ctypes.addressof(self.recv_buffers[i])
+                self.recv_iovecs[i].iov_len = buffer_size
+                header = self.recv_msgs[i].msg_hdr
+                header.msg_iov = ctypes.pointer(self.recv_iovecs[i])
+                header.msg_iovlen = 1
+
+    def recv_batch(self):
+        """
+        Return up to batch_size (data, address) pairs that are already queued,
+        an empty list when there is nothing to read.
+        """
+        if self.use_mmsg:
+            return self.recv_batch_mmsg()
+        packets = []
+        timeout = self.sock.gettimeout()
+        if not MSG_DONTWAIT:
+            self.sock.setblocking(False)
+        try:
+            while len(packets) < self.batch_size:
+                packets.append(self.sock.recvfrom(self.buffer_size, MSG_DONTWAIT))
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            if not MSG_DONTWAIT:
+                self.sock.settimeout(timeout)
+        return packets
+
+    def recv_batch_mmsg(self):
+        for i in range(self.batch_size):
+            header = self.recv_msgs[i].msg_hdr
+            header.msg_name = ctypes.addressof(self.recv_names[i])
+            header.msg_namelen = SOCKADDR_SIZE
+        count = LIBC.recvmmsg(
+            self.sock.fileno(), self.recv_msgs, self.batch_size, MSG_DONTWAIT, None
+        )
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(error, "recvmmsg: " + errno.errorcode.get(error, ""))
+        packets = []
+        for i in range(count):
+            length = self.recv_msgs[i].msg_len
+            data = self.recv_buffers[i].raw[:length]
+            packets.append((data, unpack_sockaddr(self.recv_names[i].raw)))
+        return packets
+
+    def send_batch(self, packets, address, fallback=None):
+        """
+        Send every packet, given as a list of buffers (e.g. [header, payload]),
+        to `address`. Packets sendmmsg did not take are passed to
+        fallback(buffers, address) when given, e.g. an asyncio transport.
+        """
+        sent = 0
+        if self.use_mmsg:
+            for start in range(0, len(packets), self.batch_size):
+                chunk = packets[start : start + self.batch_size]
+                done = self.send_batch_mmsg(chunk, address)
+                sent += done
+                if done < len(chunk):
+                    break
+        # Whatever sendmmsg did not take (full socket buffer) goes out one by one
+        for buffers in packets[sent:]:
+            if fallback is not None:
+                fallback(buffers, address)
+            elif hasattr(self.sock, "sendmsg"):
+                self.sock.sendmsg(buffers, [], 0, address)
+            else:
+                self.sock.sendto(b"".join(buffers), address)
+
+    def send_batch_mmsg(self, packets, address):
+        keep_alive = []
+        name = ctypes.create_string_buffer(pack_sockaddr(address))
+        msgs = (mmsghdr * len(packets))()
+        for i, buffers in enumerate(packets):
+            iovecs = (iovec * len(buffers))()
+            for j, buffer in enumerate(buffers):
+                iovecs[j].iov_base = buffer_address(buffer, keep_alive)
+                iovecs[j].iov_len = len(buffer)
+            keep_alive.append(iovecs)
+            header = msgs[i].msg_hdr
+            header.msg_name = ctypes.addressof(name)
+            header.msg_namelen = len(name) - 1
+            header.msg_iov = iovecs
+            header.msg_iovlen = len(buffers)
+        count = LIBC.sendmmsg(self.sock.fileno(), msgs, len(packets), 0)
+        # Release the exported payload buffers before returning
+        del keep_alive[:]
+        if count < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise OSError(error, "sendmmsg: " + errno.errorcode.get(error, ""))
+        return count
@@ -0,0 +1,141 @@
+import bisect
+
+
+class SegmentBitmap:
+    """
+    One bit per segment of the file, set once the segment has been written.
+    """
+
+    def __init__(self, num_segments):
+        self.num_segments = num_segments
+        self.bits = bytearray((num_segments + 7) // 8)
+        # Number of set bits
+        self.count = 0
+
+    def __contains__(self, seq):
+        return bool(self.bits[seq >> 3] & (1 << (seq & 7)))
+
+    def add(self, seq):
+        mask = 1 << (seq & 7)
+        if not self.bits[seq >> 3] & mask:
+            self.bits[seq >> 3] |= mask
+            self.count += 1
+
+    def is_complete(self):
+        return self.count == self.num_segments
+
+    def next_missing(self, start):
+        """
+        First segment at or after `start` that is not set, num_segments if none.
+        """
+        seq = start
+        while seq < self.num_segments:
+            byte = self.bits[seq >> 3]
+            if byte == 0xFF and seq & 7 == 0:
+                # Skip full bytes at once
+                seq += 8
+                continue
+            if not byte & (1 << (seq & 7)):
+                return seq
+            seq += 1
+        return self.num_segments
+
+    def to_bytes(self):
+        return bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, num_segments, data):
+        bitmap = cls(num_segments)
+        if len(data) != len(bitmap.bits):
+            raise ValueError("bitmap does not match the number of segments")
+        bitmap.bits[:] = data
+        bitmap.count = sum(bin(byte).count("1") for byte in bitmap.bits)
+        return bitmap
+
+    def missing_ranges(self, max_ranges, limit=None):
+        """
+        (start, end) ranges of unset segments below `limit` (the end of the file
+        by default), `end` is exclusive. Past `max_ranges` the last range is
+        stretched to `limit`.
+        """
+        limit = self.num_segments if limit is None else min(limit, self.num_segments)
+        ranges = []
+        seq = self.next_missing(0)
+        while seq < limit:
+            if len(ranges) == max_ranges - 1:
+                ranges.append((seq, limit))
+                break
+            end = seq + 1
+            while end < limit and end not in self:
+                end += 1
+            ranges.append((seq, end))
+            seq = self.next_missing(end)
+        return ranges
+
+
+class SackRanges:
+    """
+    Segments received out of order as disjoint [start, end) ranges, merged as
+    they arrive so building an ACK never rescans everything above the hole.
+    SACK blocks follow RFC 2018: the range holding the newest segment first,
+    then the other recently updated ranges, then the lowest ones.
+    """
+
+    def __init__(self, history):
+        # Sorted starts and ends of the ranges, both above the cumulative ACK
+        self.starts = []
+        self.ends = []
+        # Starts of the most recently updated ranges, newest first, may be stale
+        self.recent = []
+        self.history = history
+
+    def add(self, seq):
+        i = bisect.bisect_right(self.starts, seq)
+        if i and self.ends[i - 1] > seq:
+            return
+        joins_left = i and self.ends[i - 1] == seq
+        joins_right = i < len(self.starts) and self.starts[i] == seq + 1
+        if joins_left and joins_right:
+            self.ends[i - 1] = self.ends[i]
+            self.forget(self.starts[i])
+            del self.starts[i], self.ends[i]
+            start = self.starts[i - 1]
+        elif joins_left:
+            self.ends[i - 1] = seq + 1
+            start = self.starts[i - 1]
+        elif joins_right:
+            self.forget(self.starts[i])
+            self.starts[i] = start = seq
+        else:
+            self.starts.insert(i, seq)
+            self.ends.insert(i, seq + 1)
+            start = seq
+        self.forget(start)
+        self.recent.insert(0, start)
+        del self.recent[self.history:]
+
+    def forget(self, start):
+        if start in self.recent:
+            self.recent.remove(start)
+
+    def advance(self, ack_num):
+        # Drop what the cumulative ACK now covers
+        i = bisect.bisect_right(self.ends, ack_num)
+        del self.starts[:i], self.ends[:i]
+        if self.starts and self.starts[0] < ack_num:
+            self.starts[0] = ack_num
+
+    def blocks(self, max_blocks):
+        blocks = []
+        for start in self.recent:
+            if len(blocks) == max_blocks:
+                return blocks
+            i = bisect.bisect_left(self.starts, start)
+            if i < len(self.starts) and self.starts[i] == start:
+                blocks.append((start, self.ends[i]))
+        for start, end in zip(self.starts, self.ends):
+            if len(blocks) >= max_blocks:
+                break
+            if (start, end) not in blocks:
+                blocks.append((start, end))
+        return blocks
@@ -0,0 +1,181 @@
+from collections import OrderedDict
+
+
+class LruCache:
+    """
+    Least recently used replacement over at most `capacity` entries.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        # The cached value of `key`, load(key) fills a miss
+        value = self.entries.get(key)
+        if value is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+        self.misses += 1
+        value = load(key)
+        if len(self.entries) >= self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = value
+        return value
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ArcCache:
+    """
+    Adaptive replacement cache (Megiddo and Modha): T1 holds entries seen once
+    recently, T2 entries seen at least twice, and the ghost lists B1 and B2 the
+    keys just evicted from each. A hit in a ghost list moves the target size p
+    of T1 towards the list that would have kept it, so one client streaming a
+    large file through the cache does not flush the files everyone asks for.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.p = 0
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def replace(self, key):
+        # Evict the LRU entry of T1 or T2 into its ghost list
+        if self.t1 and (
+            not self.t2 or len(self.t1) > self.p or (key in self.b2 and len(self.t1) == self.p)
+        ):
+            old_key, _ = self.t1.popitem(last=False)
+            self.b1[old_key] = None
+        else:
+            old_key, _ = self.t2.popitem(last=False)
+            self.b2[old_key] = None
+        self.evictions += 1
+
+    def get(self, key, load):
+        # The cached value of `key`, load(key) fills a miss
+        if key in self.t1:
+            self.hits += 1
+            value = self.t1.pop(key)
+            self.t2[key] = value
+            return value
+        if key in self.t2:
+            self.hits += 1
+            self.t2.move_to_end(key)
+            return self.t2[key]
+        self.misses += 1
+        value = load(key)
+        full = len(self.t1) + len(self.t2) >= self.capacity
+        if key in self.b1:
+            self.p = min(self.capacity, self.p + max(len(self.b2) / len(self.b1), 1))
+            del self.b1[key]
+            if full:
+                self.replace(key)
+            self.t2[key] = value
+            return value
+        if key in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) / len(self.b2), 1))
+            del self.b2[key]
+            if full:
+                self.replace(key)
+            self.t2[key] = value
+            return value
+        if len(self.t1) + len(self.b1) >= self.capacity:
+            if len(self.t1) < self.capacity:
+                self.b1.popitem(last=False)
+                self.replace(key)
+            else:
+                self.t1.popitem(last=False)
+                self.evictions += 1
+        elif full:
+            if len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2) >= 2 * self.capacity:
+                self.b2.popitem(last=False)
+            self.replace(key)
+        self.t1[key] = value
+        return value
+
+    def __len__(self):
+        return len(self.t1) + len(self.t2)
+
+
+CACHE_POLICIES = {"lru": LruCache, "arc": ArcCache}
+
+
+class ChunkCache:
+    """
+    Hot chunks of CHUNK_SIZE bytes of the served files, at most `size` bytes
+    worth. A chunk is a slice of the file's mapping, never a copy, so every
+    worker sends from the same page cache pages; a miss asks the kernel to
+    read the chunk in ahead of the session, and the counters size the working
+    set the sessions read.
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, size, policy="arc"):
+        self.policy = policy
+        self.chunks = CACHE_POLICIES[policy](max(size // self.CHUNK_SIZE, 1))
+
+    def get_chunk(self, served_file, index):
+        return self.chunks.get(
+            (served_file.path, index), lambda _: self.load_chunk(served_file, index)
+        )
+
+    def load_chunk(self, served_file, index):
+        offset = index * self.CHUNK_SIZE
+        served_file.prefetch(offset, self.CHUNK_SIZE)
+        return served_file.read(offset, self.CHUNK_SIZE)
+
+    def get_stats(self):
+        return {
+            "cache_hits": self.chunks.hits,
+            "cache_misses": self.chunks.misses,
+            "cache_evictions": self.chunks.evictions,
+            "cache_bytes": len(self.chunks) * self.CHUNK_SIZE,
+        }
+
+
+class ChunkReader:
+    """
+    One session's reads of a file through the shared cache. The current chunk
+    is kept, so the cache is only looked up when the session moves to another
+    chunk and its counters count chunk reads, not segments.
+    """
+
+    def __init__(self, cache, served_file):
+        self.cache = cache
+        self.served_file = served_file
+        self.index = None
+        self.chunk = None
+
+    def get_chunk(self, index):
+        if index != self.index:
+            self.chunk = self.cache.get_chunk(self.served_file, index)
+            self.index = index
+        return self.chunk
+
+    def read(self, offset, length):
+        index, start = divmod(offset, self.cache.CHUNK_SIZE)
+        chunk = self.get_chunk(index)
+        if start + length <= self.cache.CHUNK_SIZE:
+            return chunk[start : start + length]
+        # The file is one mapping, a range across two chunks is still a slice of it
+        self.get_chunk(index + 1)
+        return self.served_file.read(offset, length)
+
+
+def get_hit_rate(stats):
+    lookups = stats["cache_hits"] + stats["cache_misses"]
+    return stats["cache_hits"] / lookups if lookups else 0.0
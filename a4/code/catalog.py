@@ -0,0 +1,138 @@
+import hashlib
+import mmap
+import os
+
+
+def map_file(f):
+    # (mapping, view of it), copy-on-write so ctypes can address the slices for
+    # sendmmsg; nothing writes to it. mmap refuses empty files, they get no mapping
+    if os.fstat(f.fileno()).st_size == 0:
+        return None, memoryview(b"")
+    file_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return file_map, memoryview(file_map)
+
+
+class ServedFile:
+    """
+    A file of the catalog, mapped once for every session. Segments are slices
+    of `view`, so the server never copies file data; processes forked after
+    the file was opened share its pages. The digest is only computed when first
+    asked for.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        # The mapping stays valid after the file is closed
+        with open(path, "rb") as f:
+            self.map, self.view = map_file(f)
+        self.size = len(self.view)
+        # Computed on the first get_digest
+        self.digest = None
+
+    def read(self, offset, length):
+        return self.view[offset : offset + length]
+
+    def prefetch(self, offset, length):
+        # Asks the kernel to read the range in ahead of the sessions
+        if self.map is not None and hasattr(mmap, "MADV_WILLNEED"):
+            self.map.madvise(mmap.MADV_WILLNEED, offset, length)
+
+    def get_digest(self):
+        # Identifies the content to clients resuming a partial download
+        if self.digest is None:
+            self.digest = hashlib.md5(self.view).hexdigest()
+        return self.digest
+
+    def close(self):
+        # Every slice of the view must be dropped first
+        self.view.release()
+        if self.map is not None:
+            self.map.close()
+
+
+class MappedFile:
+    """
+    A file mapped for the length of one transfer, `view` covers the whole
+    mapping and segments are slices of it, so the payload bytes are never
+    copied in Python. The with block owns the mapping: every slice must be
+    dropped before it ends, the view and then the mapping are released last.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        self.view = None
+
+    def __enter__(self):
+        # The mapping stays valid after the file is closed
+        with open(self.path, "rb") as f:
+            self.map, self.view = map_file(f)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.view.release()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # The traceback of the error still holds slices, the mapping goes with them
+                if exc_type is None:
+                    raise
+        return False
+
+
+class Catalog:
+    """
+    Files a client can ask for by name in a GET (file=<name>): regular files
+    below `root`, or only `default` without a root. A GET without a name gets
+    `default`.
+    """
+
+    def __init__(self, root, default):
+        self.root = None if root is None else os.path.realpath(root)
+        self.default = default
+        # name -> ServedFile, files stay mapped once served
+        self.files = {}
+
+    def resolve(self, name):
+        # Path of `name`, None when it is not served (outside the root, missing, not a file)
+        if name is None:
+            return self.default
+        if self.root is None:
+            return None
+        path = os.path.realpath(os.path.join(self.root, name))
+        if os.path.commonpath([self.root, path]) != self.root or not os.path.isfile(path):
+            return None
+        return path
+
+    def open(self, name):
+        if name in self.files:
+            return self.files[name]
+        path = self.resolve(name)
+        if path is None:
+            return None
+        try:
+            served_file = ServedFile(name, path)
+        except OSError:
+            return None
+        self.files[name] = served_file
+        return served_file
+
+    def open_all(self):
+        """
+        Maps every file that can be served, so worker processes forked afterwards
+        share the mappings. Files that appear later are mapped by the first
+        worker asked for them.
+        """
+        self.open(None)
+        if self.root is None:
+            return
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                self.open(os.path.relpath(os.path.join(directory, name), self.root))
+
+    def close(self):
+        for served_file in self.files.values():
+            served_file.close()
+        self.files = {}
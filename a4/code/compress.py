@@ -0,0 +1,128 @@
+import zlib
+
+# lz4 and zstd are optional, zlib is always there
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Lz4Compressor:
+    # The frame header goes in front of the first output
+    def __init__(self):
+        self.compressor = lz4.frame.LZ4FrameCompressor()
+        self.header = self.compressor.begin()
+
+    def compress(self, data):
+        output = self.header + self.compressor.compress(data)
+        self.header = b""
+        return output
+
+    def flush(self):
+        return self.header + self.compressor.flush()
+
+
+class StreamDecompressor:
+    # Same interface as zlib's decompressobj for the codecs that have no flush
+    def __init__(self, decompressor):
+        self.decompressor = decompressor
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        return b""
+
+
+def get_codecs():
+    # Codecs available here, the preferred ones first
+    codecs = []
+    if zstandard is not None:
+        codecs.append("zstd")
+    if lz4 is not None:
+        codecs.append("lz4")
+    codecs.append("zlib")
+    return codecs
+
+
+def choose_codec(offered):
+    # First codec of the client's comma separated list that is available here
+    for codec in offered.split(","):
+        if codec in get_codecs():
+            return codec
+    return None
+
+
+def make_compressor(codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compressobj()
+    if codec == "lz4":
+        return Lz4Compressor()
+    return zlib.compressobj()
+
+
+def make_decompressor(codec):
+    if codec == "zstd":
+        return StreamDecompressor(zstandard.ZstdDecompressor().decompressobj())
+    if codec == "lz4":
+        return StreamDecompressor(lz4.frame.LZ4FrameDecompressor())
+    return zlib.decompressobj()
+
+
+class CompressedStream:
+    """
+    Compresses `view` as one stream, CHUNK_SIZE bytes at a time as the sender
+    asks for further segments, and cuts the output into segments of `mss` bytes.
+    Segments must be asked for in increasing order, the ones below the last
+    request are forgotten (the sender keeps what is in flight). The uncompressed
+    data also goes into `digest` when one is given.
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, view, codec, mss, digest=None):
+        self.view = view
+        self.digest = digest
+        self.mss = mss
+        self.compressor = make_compressor(codec)
+        # Uncompressed bytes consumed and compressed bytes produced so far
+        self.offset = 0
+        self.compressed_size = 0
+        # Compressed bytes not cut into a segment yet
+        self.pending = bytearray()
+        # seq -> segment, for the segments cut but not left behind yet
+        self.segments = {}
+        self.next_seq = 0
+        self.finished = False
+
+    def compress_chunk(self):
+        if self.offset < len(self.view):
+            chunk = self.view[self.offset : self.offset + self.CHUNK_SIZE]
+            self.pending += self.compressor.compress(chunk)
+            if self.digest is not None:
+                self.digest.update(chunk)
+            self.offset += len(chunk)
+            chunk.release()
+        else:
+            self.pending += self.compressor.flush()
+            self.finished = True
+        while len(self.pending) >= self.mss or (self.finished and self.pending):
+            self.segments[self.next_seq] = bytes(self.pending[: self.mss])
+            del self.pending[: self.mss]
+            self.compressed_size += len(self.segments[self.next_seq])
+            self.next_seq += 1
+
+    def has_segment(self, seq):
+        while seq >= self.next_seq and not self.finished:
+            self.compress_chunk()
+        return seq < self.next_seq
+
+    def get_segment(self, seq):
+        self.has_segment(seq)
+        for old_seq in [s for s in self.segments if s < seq]:
+            del self.segments[old_seq]
+        return self.segments[seq]
@@ -0,0 +1,453 @@
+import abc
+import collections
+import math
+import random
+
+
+class CongestionController(abc.ABC):
+    """
+    Interface between the sender and a congestion control algorithm. Windows are
+    counted in bytes, the sender keeps track of the bytes in flight (sent, not
+    cumulatively acked and not sacked) and reports every event to the controller.
+    The sender's RttEstimator is shared, its min RTT is the path's propagation
+    delay for the controllers that need one.
+    """
+
+    # Data packets carry a send timestamp the receiver echoes in its ACKs
+    USES_TIMESTAMPS = False
+
+    def __init__(self, mss, rtt_estimator):
+        self.mss = mss
+        self.rtt_estimator = rtt_estimator
+
+    def on_send(self, now, seq, size, in_flight):
+        """
+        A packet of `size` bytes left, `in_flight` already counts it when it is new.
+        """
+
+    @abc.abstractmethod
+    def on_ack(self, now, acked_bytes, rtt, in_flight):
+        """
+        A cumulative ACK took `acked_bytes` out of flight, `rtt` is the sample it
+        gave or None.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def on_dupack(self, now, dup_count, repeats, in_flight):
+        """
+        `dup_count` duplicate ACKs in a row for the same cumulative ACK, the last
+        `repeats` of them arrived together in one batch.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def on_timeout(self, now, in_flight):
+        raise NotImplementedError
+
+    def on_delay_sample(self, now, delay):
+        """
+        One-way delay of a packet in seconds, offset by the difference between
+        the receiver's and the sender's clock. Only used with USES_TIMESTAMPS.
+        """
+
+    @abc.abstractmethod
+    def cwnd_bytes(self):
+        raise NotImplementedError
+
+    def pacing_rate(self):
+        # Bytes per second the sender should not exceed, None leaves it window limited
+        return None
+
+    def in_slow_start(self):
+        # The sender paces slow start faster so the window can still double
+        return False
+
+
+class Reno(CongestionController):
+    """
+    Slow start, congestion avoidance and fast recovery (RFC 5681).
+    """
+
+    SLOW_START = "SS"
+    CONGESTION_AVOIDANCE = "CA"
+    FAST_RECOVERY = "FR"
+    # Duplicate ACKs that signal a loss
+    DUP_ACK_THRESHOLD = 3
+    INITIAL_SSTHRESH = 64000
+
+    def __init__(self, mss, rtt_estimator):
+        super().__init__(mss, rtt_estimator)
+        self.state = self.SLOW_START
+        self.cwnd = mss
+        self.ssthresh = self.INITIAL_SSTHRESH
+
+    def on_ack(self, now, acked_bytes, rtt, in_flight):
+        if self.state == self.FAST_RECOVERY:
+            # Deflate the window once the loss is repaired
+            self.cwnd = self.ssthresh
+            self.state = self.CONGESTION_AVOIDANCE
+        elif self.state == self.SLOW_START:
+            self.cwnd += acked_bytes
+            if self.cwnd >= self.ssthresh:
+                self.state = self.CONGESTION_AVOIDANCE
+        else:
+            self.grow_window(now, acked_bytes)
+
+    def on_dupack(self, now, dup_count, repeats, in_flight):
+        if self.state == self.FAST_RECOVERY:
+            # Every duplicate ACK means a packet left the network
+            self.cwnd += repeats * self.mss
+        elif dup_count >= self.DUP_ACK_THRESHOLD:
+            self.ssthresh = self.reduce_window(in_flight)
+            # Inflated by the duplicates past the threshold a batch may carry
+            self.cwnd = self.ssthresh + dup_count * self.mss
+            self.state = self.FAST_RECOVERY
+
+    def on_timeout(self, now, in_flight):
+        self.ssthresh = self.reduce_window(in_flight)
+        self.cwnd = self.mss
+        self.state = self.SLOW_START
+
+    def grow_window(self, now, acked_bytes):
+        # Congestion avoidance, about one MSS per RTT
+        self.cwnd += self.mss * acked_bytes / self.cwnd
+
+    def reduce_window(self, in_flight):
+        # New ssthresh after a loss
+        return max(in_flight / 2, 2 * self.mss)
+
+    def cwnd_bytes(self):
+        return int(self.cwnd)
+
+    def in_slow_start(self):
+        return self.state == self.SLOW_START
+
+
+class Cubic(Reno):
+    """
+    CUBIC (RFC 9438). After a loss the window follows a cubic function of the time
+    since the loss, flat around the window where the loss happened (W_max) and
+    steep far from it, so long fat pipes are refilled in a few RTTs instead of one
+    MSS per RTT. Slow start and fast recovery are Reno's.
+    """
+
+    # Scaling constant of the cubic function, in MSS per second^3
+    C = 0.4
+    # Multiplicative decrease factor
+    BETA = 0.7
+
+    def __init__(self, mss, rtt_estimator):
+        super().__init__(mss, rtt_estimator)
+        # Window before the last reduction, in bytes
+        self.w_max = 0
+        # Start of the current congestion avoidance epoch, None until the next ACK
+        self.epoch_start = None
+        # Seconds the cubic function takes to climb back to its origin
+        self.k = 0
+        self.origin = 0
+        # Window a Reno flow would have reached in the same epoch
+        self.w_est = 0
+
+    def grow_window(self, now, acked_bytes):
+        if self.epoch_start is None:
+            self.epoch_start = now
+            self.w_est = self.cwnd
+            if self.cwnd < self.w_max:
+                self.k = ((self.w_max - self.cwnd) / self.mss / self.C) ** (1 / 3)
+                self.origin = self.w_max
+            else:
+                self.k = 0
+                self.origin = self.cwnd
+        # Aim for the window one RTT ahead
+        t = now - self.epoch_start + (self.rtt_estimator.min_rtt or 0)
+        target = self.origin + self.C * (t - self.k) ** 3 * self.mss
+        target = min(max(target, self.cwnd), 1.5 * self.cwnd)
+        # TCP-friendly region, never grow slower than Reno would
+        alpha = 3 * (1 - self.BETA) / (1 + self.BETA)
+        self.w_est += alpha * self.mss * acked_bytes / self.cwnd
+        if self.w_est > target:
+            self.cwnd = self.w_est
+        else:
+            self.cwnd += (target - self.cwnd) * acked_bytes / self.cwnd
+
+    def reduce_window(self, in_flight):
+        if self.cwnd < self.w_max:
+            # Fast convergence, release bandwidth to newer flows
+            self.w_max = self.cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = self.cwnd
+        self.epoch_start = None
+        return max(self.cwnd * self.BETA, 2 * self.mss)
+
+
+class BBR(CongestionController):
+    """
+    BBR-style model based control. Every ACK gives a delivery rate sample, the
+    bottleneck bandwidth is their windowed max and the propagation delay the
+    windowed min RTT. The sender is paced at gain x bandwidth and the data in
+    flight is capped at a small multiple of their product, so the bottleneck
+    queue stays nearly empty instead of being filled until it drops packets.
+    """
+
+    STARTUP = "STARTUP"
+    DRAIN = "DRAIN"
+    PROBE_BW = "PROBE_BW"
+    PROBE_RTT = "PROBE_RTT"
+    # Smallest gain that doubles the sending rate every round in startup
+    HIGH_GAIN = 2 / math.log(2)
+    # Pacing gains of the PROBE_BW phases, one min RTT each
+    PACING_GAIN_CYCLE = (1.25, 0.75, 1, 1, 1, 1, 1, 1)
+    CWND_GAIN = 2
+    # Rounds remembered by the max bandwidth filter
+    BW_WINDOW_ROUNDS = 10
+    PROBE_RTT_DURATION = 0.2
+    # Startup ends after this many rounds without 25% bandwidth growth
+    FULL_BW_ROUNDS = 3
+    FULL_BW_GROWTH = 1.25
+    # Windows in MSS
+    INITIAL_CWND = 10
+    MIN_CWND = 4
+    # Error tolerated when matching an RTT sample with its send time, echoed
+    # timestamps have a microsecond resolution
+    TIME_TOLERANCE = 2e-6
+
+    def __init__(self, mss, rtt_estimator):
+        super().__init__(mss, rtt_estimator)
+        self.state = self.STARTUP
+        self.pacing_gain = self.HIGH_GAIN
+        self.cwnd_gain = self.HIGH_GAIN
+        self.cwnd = self.INITIAL_CWND * mss
+        # Delivery rate estimation, (sent time, delivered, delivered time) per packet
+        self.delivered = 0
+        self.delivered_time = None
+        self.sent_packets = collections.deque()
+        # Max bandwidth filter, a decreasing deque of (round, bytes per second)
+        self.bw_samples = collections.deque()
+        self.btl_bw = 0
+        # A round ends when a packet sent after its start is acked
+        self.round_count = 0
+        self.next_round_delivered = 0
+        # Startup
+        self.filled_pipe = False
+        self.full_bw = 0
+        self.full_bw_count = 0
+        # PROBE_BW
+        self.cycle_index = 0
+        self.cycle_stamp = None
+        # PROBE_RTT
+        self.prior_cwnd = 0
+        self.probe_rtt_done_stamp = None
+        self.probe_rtt_round_done = False
+
+    def on_send(self, now, seq, size, in_flight):
+        if self.delivered_time is None:
+            self.delivered_time = now
+        self.sent_packets.append((now, self.delivered, self.delivered_time))
+
+    def on_ack(self, now, acked_bytes, rtt, in_flight):
+        self.delivered += acked_bytes
+        self.delivered_time = now
+        round_start = False
+        min_rtt_expired = False
+        if rtt is not None:
+            # The sample belongs to the newest packet sent `rtt` ago
+            packet = None
+            sent_time = now - rtt + self.TIME_TOLERANCE
+            while self.sent_packets and self.sent_packets[0][0] <= sent_time:
+                packet = self.sent_packets.popleft()
+            if packet is not None:
+                _, delivered, delivered_time = packet
+                if delivered >= self.next_round_delivered:
+                    self.next_round_delivered = self.delivered
+                    self.round_count += 1
+                    round_start = True
+                if now > delivered_time:
+                    self.update_btl_bw((self.delivered - delivered) / (now - delivered_time))
+            # A min RTT not lowered for the estimator's window is measured again
+            min_rtt_expired = self.rtt_estimator.min_rtt_expired
+        self.update_state(now, in_flight, round_start, min_rtt_expired)
+        self.update_cwnd(acked_bytes)
+
+    def on_dupack(self, now, dup_count, repeats, in_flight):
+        # Losses are not a congestion signal, the model already bounds the queue
+        pass
+
+    def on_timeout(self, now, in_flight):
+        # Fall back to a minimal window, the model grows it back as ACKs return
+        self.prior_cwnd = max(self.prior_cwnd, self.cwnd)
+        self.cwnd = self.MIN_CWND * self.mss
+
+    def update_btl_bw(self, rate):
+        while self.bw_samples and self.bw_samples[-1][1] <= rate:
+            self.bw_samples.pop()
+        self.bw_samples.append((self.round_count, rate))
+        while self.bw_samples[0][0] <= self.round_count - self.BW_WINDOW_ROUNDS:
+            self.bw_samples.popleft()
+        self.btl_bw = self.bw_samples[0][1]
+
+    def get_bdp(self, gain):
+        min_rtt = self.rtt_estimator.min_rtt
+        if not self.btl_bw or min_rtt is None:
+            return self.INITIAL_CWND * self.mss
+        return gain * self.btl_bw * min_rtt
+
+    def update_state(self, now, in_flight, round_start, min_rtt_expired):
+        if not self.filled_pipe and round_start:
+            if self.btl_bw >= self.full_bw * self.FULL_BW_GROWTH:
+                self.full_bw = self.btl_bw
+                self.full_bw_count = 0
+            else:
+                self.full_bw_count += 1
+                self.filled_pipe = self.full_bw_count >= self.FULL_BW_ROUNDS
+        if self.state == self.STARTUP and self.filled_pipe:
+            # Drain the queue startup built
+            self.state = self.DRAIN
+            self.pacing_gain = 1 / self.HIGH_GAIN
+        if self.state == self.DRAIN and in_flight <= self.get_bdp(1):
+            self.enter_probe_bw(now)
+        min_rtt = self.rtt_estimator.min_rtt or 0
+        if self.state == self.PROBE_BW and now - self.cycle_stamp > min_rtt:
+            self.cycle_index = (self.cycle_index + 1) % len(self.PACING_GAIN_CYCLE)
+            self.cycle_stamp = now
+            self.pacing_gain = self.PACING_GAIN_CYCLE[self.cycle_index]
+        if min_rtt_expired and self.state != self.PROBE_RTT:
+            self.state = self.PROBE_RTT
+            self.pacing_gain = 1
+            self.prior_cwnd = max(self.prior_cwnd, self.cwnd)
+            self.probe_rtt_done_stamp = None
+        if self.state == self.PROBE_RTT:
+            self.update_probe_rtt(now, in_flight, round_start)
+
+    def enter_probe_bw(self, now):
+        self.state = self.PROBE_BW
+        self.cwnd_gain = self.CWND_GAIN
+        # Start anywhere but in the draining phase
+        self.cycle_index = random.choice(
+            [i for i, gain in enumerate(self.PACING_GAIN_CYCLE) if gain >= 1]
+        )
+        self.cycle_stamp = now
+        self.pacing_gain = self.PACING_GAIN_CYCLE[self.cycle_index]
+
+    def update_probe_rtt(self, now, in_flight, round_start):
+        # Hold the window at MIN_CWND for PROBE_RTT_DURATION and one round
+        if self.probe_rtt_done_stamp is None:
+            if in_flight <= self.MIN_CWND * self.mss:
+                self.probe_rtt_done_stamp = now + self.PROBE_RTT_DURATION
+                self.probe_rtt_round_done = False
+                self.next_round_delivered = self.delivered
+            return
+        if round_start:
+            self.probe_rtt_round_done = True
+        if self.probe_rtt_round_done and now > self.probe_rtt_done_stamp:
+            self.cwnd = max(self.cwnd, self.prior_cwnd)
+            self.prior_cwnd = 0
+            if self.filled_pipe:
+                self.enter_probe_bw(now)
+            else:
+                self.state = self.STARTUP
+                self.pacing_gain = self.HIGH_GAIN
+
+    def update_cwnd(self, acked_bytes):
+        if self.state == self.PROBE_RTT:
+            self.cwnd = min(self.cwnd, self.MIN_CWND * self.mss)
+            return
+        # A few extra packets keep the pipe full while ACKs are delayed or batched
+        target = self.get_bdp(self.cwnd_gain) + 3 * self.mss
+        if self.filled_pipe:
+            self.cwnd = min(self.cwnd + acked_bytes, target)
+        elif self.cwnd < target or self.delivered < self.INITIAL_CWND * self.mss:
+            self.cwnd += acked_bytes
+        self.cwnd = max(self.cwnd, self.MIN_CWND * self.mss)
+
+    def cwnd_bytes(self):
+        return int(self.cwnd)
+
+    def pacing_rate(self):
+        if not self.btl_bw:
+            return None
+        return self.pacing_gain * self.btl_bw
+
+
+class Ledbat(CongestionController):
+    """
+    LEDBAT (RFC 6817) scavenger mode for background transfers. The window
+    follows the queuing delay, the one-way delay above the lowest one seen,
+    towards a fixed target, so the flow backs off as soon as a queue builds
+    and long before loss based flows sharing the bottleneck see drops.
+    """
+
+    USES_TIMESTAMPS = True
+    # Queuing delay the flow aims for, below the delay of a full bottleneck queue
+    TARGET = 0.025
+    GAIN = 1
+    # Delay samples whose minimum is the current delay
+    CURRENT_FILTER = 4
+    # Minutes of per-minute minimum delays kept for the base delay
+    BASE_HISTORY = 10
+    # Bytes in MSS the window may exceed the data in flight by
+    ALLOWED_INCREASE = 1
+    MIN_CWND = 2
+    DUP_ACK_THRESHOLD = 3
+
+    def __init__(self, mss, rtt_estimator):
+        super().__init__(mss, rtt_estimator)
+        self.cwnd = self.MIN_CWND * mss
+        self.current_delays = collections.deque(maxlen=self.CURRENT_FILTER)
+        # (minute, lowest delay in that minute)
+        self.base_delays = collections.deque(maxlen=self.BASE_HISTORY)
+        # Grow exponentially until the queuing delay nears the target
+        self.slow_start = True
+        self.in_recovery = False
+
+    def on_delay_sample(self, now, delay):
+        self.current_delays.append(delay)
+        minute = int(now // 60)
+        if self.base_delays and self.base_delays[-1][0] == minute:
+            if delay < self.base_delays[-1][1]:
+                self.base_delays[-1] = (minute, delay)
+        else:
+            self.base_delays.append((minute, delay))
+
+    def get_queuing_delay(self):
+        if not self.current_delays:
+            return 0
+        return min(self.current_delays) - min(delay for _, delay in self.base_delays)
+
+    def on_ack(self, now, acked_bytes, rtt, in_flight):
+        self.in_recovery = False
+        queuing_delay = self.get_queuing_delay()
+        if self.slow_start and queuing_delay < self.TARGET * 3 / 4:
+            self.cwnd += acked_bytes
+        else:
+            self.slow_start = False
+            off_target = (self.TARGET - queuing_delay) / self.TARGET
+            self.cwnd += self.GAIN * off_target * acked_bytes * self.mss / self.cwnd
+        # Do not grow a window the sender is not using
+        max_allowed_cwnd = in_flight + acked_bytes + self.ALLOWED_INCREASE * self.mss
+        self.cwnd = max(min(self.cwnd, max_allowed_cwnd), self.MIN_CWND * self.mss)
+
+    def on_dupack(self, now, dup_count, repeats, in_flight):
+        # Halve at most once per loss event
+        if dup_count >= self.DUP_ACK_THRESHOLD and not self.in_recovery:
+            self.in_recovery = True
+            self.slow_start = False
+            self.cwnd = max(self.cwnd / 2, self.MIN_CWND * self.mss)
+
+    def on_timeout(self, now, in_flight):
+        self.slow_start = False
+        self.cwnd = self.mss
+
+    def cwnd_bytes(self):
+        return int(self.cwnd)
+
+    def in_slow_start(self):
+        return self.slow_start
+
+
+# Controllers selectable from the command line
+CONTROLLERS = {"reno": Reno, "cubic": Cubic, "bbr": BBR, "ledbat": Ledbat}
+
+
+def make_controller(name, mss, rtt_estimator):
+    return CONTROLLERS[name](mss, rtt_estimator)
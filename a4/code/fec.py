@@ -0,0 +1,272 @@
+import math
+
+# Reed-Solomon needs vectorized GF(256) arithmetic, without numpy only the XOR
+# code (one parity packet per block) is available
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Each segment is coded as a 2-byte length followed by its data, zero padded
+LENGTH_SIZE = 2
+
+
+def make_symbol(data, symbol_size):
+    return len(data).to_bytes(LENGTH_SIZE, byteorder="big") + bytes(data) + bytes(
+        symbol_size - LENGTH_SIZE - len(data)
+    )
+
+
+def parse_symbol(symbol):
+    length = int.from_bytes(symbol[:LENGTH_SIZE], byteorder="big")
+    return bytes(symbol[LENGTH_SIZE : LENGTH_SIZE + length])
+
+
+def xor_symbols(symbols, symbol_size):
+    parity = 0
+    for symbol in symbols:
+        parity ^= int.from_bytes(symbol, byteorder="big")
+    return parity.to_bytes(symbol_size, byteorder="big")
+
+
+def make_gf_tables():
+    # GF(2^8) with the polynomial x^8 + x^4 + x^3 + x^2 + 1 and generator 2
+    exp = [0] * 512
+    log = [0] * 256
+    value = 1
+    for power in range(255):
+        exp[power] = value
+        log[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= 0x11D
+    for power in range(255, 512):
+        exp[power] = exp[power - 255]
+    return exp, log
+
+
+GF_EXP, GF_LOG = make_gf_tables()
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_inv(a):
+    return GF_EXP[255 - GF_LOG[a]]
+
+
+def make_mul_table():
+    # MUL_TABLE[c][v] = c * v, one fancy-indexing lookup multiplies a whole symbol
+    if np is None:
+        return None
+    log = np.array(GF_LOG, dtype=np.int32)
+    exp = np.array(GF_EXP, dtype=np.uint8)
+    table = exp[log[:, None] + log[None, :]]
+    table[0, :] = 0
+    table[:, 0] = 0
+    return table
+
+
+MUL_TABLE = make_mul_table()
+
+
+def cauchy_coefficient(k, row, column):
+    # Rows k..k+r-1 against columns 0..k-1, every square submatrix is invertible
+    return gf_inv((k + row) ^ column)
+
+
+def rs_encode(symbols, r):
+    data = np.frombuffer(b"".join(symbols), dtype=np.uint8).reshape(len(symbols), -1)
+    parities = []
+    for row in range(r):
+        parity = np.zeros(data.shape[1], dtype=np.uint8)
+        for column in range(len(symbols)):
+            parity ^= MUL_TABLE[cauchy_coefficient(len(symbols), row, column)][data[column]]
+        parities.append(parity.tobytes())
+    return parities
+
+
+def gf_invert_matrix(matrix):
+    # Gauss-Jordan elimination over GF(256) on a small square matrix
+    size = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(size)] for i, row in enumerate(matrix)]
+    for column in range(size):
+        pivot = next(i for i in range(column, size) if rows[i][column])
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        scale = gf_inv(rows[column][column])
+        rows[column] = [gf_mul(scale, value) for value in rows[column]]
+        for i in range(size):
+            factor = rows[i][column]
+            if i != column and factor:
+                rows[i] = [
+                    value ^ gf_mul(factor, pivot_value)
+                    for value, pivot_value in zip(rows[i], rows[column])
+                ]
+    return [row[size:] for row in rows]
+
+
+def rs_decode(k, known, parities, missing):
+    """
+    Rebuild the symbols of the `missing` columns from the `known` {column: symbol}
+    and at least len(missing) `parities` {row: symbol}.
+    """
+    rows = sorted(parities)[: len(missing)]
+    remainders = []
+    for row in rows:
+        remainder = np.frombuffer(parities[row], dtype=np.uint8).copy()
+        for column, symbol in known.items():
+            remainder ^= MUL_TABLE[cauchy_coefficient(k, row, column)][
+                np.frombuffer(symbol, dtype=np.uint8)
+            ]
+        remainders.append(remainder)
+    inverse = gf_invert_matrix(
+        [[cauchy_coefficient(k, row, column) for column in missing] for row in rows]
+    )
+    recovered = {}
+    for i, column in enumerate(missing):
+        symbol = np.zeros(len(remainders[0]), dtype=np.uint8)
+        for j, remainder in enumerate(remainders):
+            symbol ^= MUL_TABLE[inverse[i][j]][remainder]
+        recovered[column] = symbol.tobytes()
+    return recovered
+
+
+class FecEncoder:
+    """
+    Groups the data segments in blocks of k and emits r parity symbols after the
+    last segment of every block, XOR for r = 1 and Reed-Solomon above. k and r
+    are chosen again at every block boundary from the measured loss rate.
+    """
+
+    MIN_K = 4
+    MAX_K = 32
+    # Block size of the Reed-Solomon code, its redundancy follows the loss rate
+    RS_K = 16
+    MAX_R = 8
+    # XOR is kept while a block is expected to lose at most this many packets
+    XOR_LOSSES_PER_BLOCK = 0.5
+    # Gain of the loss rate moving average, updated once per block
+    LOSS_GAIN = 0.25
+
+    def __init__(self, mss):
+        self.symbol_size = mss + LENGTH_SIZE
+        self.loss_rate = 0.0
+        self.k = self.MAX_K
+        self.r = 1
+        self.block_start = 0
+        self.symbols = []
+        # Transmissions and retransmissions since the last block boundary
+        self.sent = 0
+        self.lost = 0
+
+    def on_sent(self, retransmission):
+        self.sent += 1
+        if retransmission:
+            self.lost += 1
+
+    def update_block_size(self):
+        if self.sent:
+            sample = self.lost / self.sent
+            self.loss_rate += self.LOSS_GAIN * (sample - self.loss_rate)
+            self.sent = self.lost = 0
+        expected = self.loss_rate * self.RS_K
+        if np is None or expected <= self.XOR_LOSSES_PER_BLOCK:
+            # Largest block whose expected losses one XOR parity still covers
+            self.r = 1
+            if self.loss_rate > 0:
+                k = int(self.XOR_LOSSES_PER_BLOCK / self.loss_rate)
+            else:
+                k = self.MAX_K
+            self.k = min(max(k, self.MIN_K), self.MAX_K)
+        else:
+            # Expected losses plus two standard deviations
+            self.k = self.RS_K
+            self.r = min(math.ceil(expected + 2 * math.sqrt(expected)), self.MAX_R)
+
+    def add_segment(self, seq, data, last):
+        """
+        Feed the next new segment, returns (block_start, k, r, index, symbol) for
+        every parity packet due after it.
+        """
+        if not self.symbols:
+            self.block_start = seq
+        self.symbols.append(make_symbol(data, self.symbol_size))
+        if len(self.symbols) < self.k and not last:
+            return []
+        k = len(self.symbols)
+        if self.r == 1:
+            parities = [xor_symbols(self.symbols, self.symbol_size)]
+        else:
+            parities = rs_encode(self.symbols, self.r)
+        packets = [
+            (self.block_start, k, self.r, index, parity)
+            for index, parity in enumerate(parities)
+        ]
+        self.symbols = []
+        self.update_block_size()
+        return packets
+
+
+class FecDecoder:
+    """
+    Keeps the parity symbols of the blocks that still miss segments and rebuilds
+    the missing ones once enough parity arrived.
+    """
+
+    def __init__(self):
+        # block_start -> (k, r, {index: symbol})
+        self.blocks = {}
+
+    def add_parity(self, block_start, k, r, index, symbol):
+        if r > 1 and np is None:
+            # Reed-Solomon blocks cannot be decoded here, wait for retransmissions
+            return
+        self.blocks.setdefault(block_start, (k, r, {}))[2][index] = symbol
+
+    def find_block(self, seq):
+        for block_start, (k, _, _) in self.blocks.items():
+            if block_start <= seq < block_start + k:
+                return block_start
+        return None
+
+    def drop_before(self, seq):
+        # Blocks entirely below `seq` are complete
+        for block_start in [
+            start for start, (k, _, _) in self.blocks.items() if start + k <= seq
+        ]:
+            del self.blocks[block_start]
+
+    def decode(self, block_start, has_segment, read_segment):
+        """
+        Returns [(seq, data)] of the segments rebuilt in the block, empty when
+        nothing is missing or too much is.
+        """
+        k, r, parities = self.blocks[block_start]
+        missing = [
+            column for column in range(k) if not has_segment(block_start + column)
+        ]
+        if not missing:
+            del self.blocks[block_start]
+            return []
+        if len(missing) > len(parities):
+            return []
+        symbol_size = len(next(iter(parities.values())))
+        known = {
+            column: make_symbol(read_segment(block_start + column), symbol_size)
+            for column in range(k)
+            if column not in missing
+        }
+        if r == 1:
+            recovered = {
+                missing[0]: xor_symbols(list(known.values()) + [parities[0]], symbol_size)
+            }
+        else:
+            recovered = rs_decode(k, known, parities, missing)
+        del self.blocks[block_start]
+        return [
+            (block_start + column, parse_symbol(symbol))
+            for column, symbol in sorted(recovered.items())
+        ]
@@ -0,0 +1,45 @@
+import hashlib
+import zlib
+
+# CRC32C and xxHash are optional, zlib's CRC-32 is always there
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def get_checksums():
+    # Segment checksums available here, the preferred ones first
+    checksums = []
+    if crc32c is not None:
+        checksums.append("crc32c")
+    if xxhash is not None:
+        checksums.append("xxh32")
+    checksums.append("crc32")
+    return checksums
+
+
+def choose_checksum(offered):
+    # First checksum of the client's comma separated list that is available here
+    for checksum in offered.split(","):
+        if checksum in get_checksums():
+            return checksum
+    return None
+
+
+def make_checksum(name):
+    # checksum(data, value) continues the 32-bit checksum `value` over `data`
+    if name == "crc32c":
+        return crc32c.crc32c
+    if name == "xxh32":
+        return lambda data, value=0: xxhash.xxh32_intdigest(data, seed=value)
+    return zlib.crc32
+
+
+def make_file_digest():
+    # Digest of the whole file, the one the experiments compare
+    return hashlib.md5()
@@ -0,0 +1,252 @@
+import argparse
+import logging
+import os
+import random
+import select
+import socket
+import time
+from utils import make_request, parse_request
+from batch_io import BatchIO
+from bitmap import SegmentBitmap
+from integrity import make_file_digest
+from wire import WIRE_V2, DATA, EOF
+from tracing import configure_logging, LOG_LEVELS
+
+DOWNLOAD_FILE_NAME = "downloaded_file.bin"
+
+log = logging.getLogger("mcast_client")
+
+
+class MulticastClient:
+    """
+    Receiver of mcast_server.py. It joins the transfer, writes every segment at
+    its offset and NAKs the gaps: after a random backoff, so the receivers that
+    lost the same packet do not all NAK at once, then every NAK_INTERVAL until
+    the repairs arrive.
+    """
+
+    # Buffer size for one data packet
+    BUFFER_SIZE = 2048
+    # Datagrams drained per recvmmsg call
+    BATCH_SIZE = 64
+    # Socket buffer asked for, the kernel caps it at net.core.rmem_max
+    RECV_BUFFER_SIZE = 4 << 20
+    # Seconds between JOINs until the server answers
+    JOIN_INTERVAL = 0.5
+    # Longest random delay of the first NAK for a new gap
+    NAK_BACKOFF = 0.02
+    # Seconds between NAKs while segments are still missing
+    NAK_INTERVAL = 0.2
+    # Missing ranges per NAK, about 1200 bytes of text, the ranges past them are
+    # NAKed next time
+    MAX_NAK_RANGES = 100
+    # Seconds without any packet before the tail of the file is NAKed
+    IDLE_TIMEOUT = 1.0
+    # Idle timeouts in a row before the client gives up
+    MAX_IDLE = 10
+    # DONE is not acknowledged, it is sent a few times
+    DONE_REPEATS = 3
+    # Bytes read back per call when hashing the output
+    DIGEST_CHUNK = 1 << 20
+
+    def __init__(self, server_ip, server_port, group, interface, pref_outfile, download_file_name):
+        self.server_ip = server_ip
+        self.server_port = server_port
+        # Control messages go to the server from an ephemeral port, without a group
+        # the data arrives on it as well
+        self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if group is None:
+            self.data_socket = self.control_socket
+        else:
+            self.data_socket = self.join_group(group, interface)
+        self.data_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECV_BUFFER_SIZE)
+        self.batch_io = BatchIO(self.data_socket, self.BATCH_SIZE, self.BUFFER_SIZE)
+        self.output_filename = f"{pref_outfile}_{download_file_name}"
+        start_time = time.time()
+        self.receive_file()
+        end_time = time.time()
+        log.info(f"Time taken to download the file: {end_time - start_time} seconds")
+
+    def join_group(self, group, interface):
+        # Several receivers on one host share the group port
+        data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        data_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        data_socket.bind(("", group[1]))
+        membership = socket.inet_aton(group[0]) + socket.inet_aton(interface)
+        data_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        return data_socket
+
+    def send_control(self, command, options):
+        self.control_socket.sendto(
+            make_request(command, options), (self.server_ip, self.server_port)
+        )
+
+    def join(self):
+        # The file metadata, data that arrives before it is NAKed later
+        self.control_socket.settimeout(self.JOIN_INTERVAL)
+        while True:
+            log.info(f"{self.server_ip}:{self.server_port} /JOIN")
+            self.send_control("JOIN", {})
+            try:
+                packet, _ = self.control_socket.recvfrom(self.BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            command, options = parse_request(packet)
+            if command == "FILE":
+                return options
+
+    def receive_file(self):
+        options = self.join()
+        self.session = options["session"]
+        self.file_size = int(options["size"])
+        self.mss = int(options["mss"])
+        self.digest = options.get("digest")
+        self.bitmap = SegmentBitmap((self.file_size + self.mss - 1) // self.mss)
+        self.highest_seq = -1
+        self.eof_received = False
+        # When the next NAK is due, None while nothing is missing
+        self.next_nak = None
+        self.naks = 0
+        log.info(f"Receiving {self.file_size} bytes in {self.bitmap.num_segments} segments")
+        sockets = [self.data_socket]
+        if self.control_socket is not self.data_socket:
+            sockets.append(self.control_socket)
+        with open(self.output_filename, "w+b") as download_file:
+            # Reserve the whole file up front so positional writes never extend it
+            os.ftruncate(download_file.fileno(), self.file_size)
+            last_packet = time.time()
+            idle_count = 0
+            while not self.bitmap.is_complete():
+                now = time.time()
+                wait = self.IDLE_TIMEOUT - (now - last_packet)
+                if self.next_nak is not None:
+                    wait = min(wait, self.next_nak - now)
+                readable, _, _ = select.select(sockets, [], [], max(wait, 0))
+                now = time.time()
+                if self.data_socket in readable:
+                    for packet, _ in self.batch_io.recv_batch():
+                        self.process_packet(packet, download_file, now)
+                    last_packet = now
+                    idle_count = 0
+                if self.control_socket in readable and self.control_socket is not self.data_socket:
+                    # A repeated FILE reply, nothing else is sent there
+                    self.control_socket.recvfrom(self.BUFFER_SIZE)
+                if now - last_packet >= self.IDLE_TIMEOUT:
+                    # The tail of the file and the EOF may all be lost
+                    idle_count += 1
+                    if idle_count > self.MAX_IDLE:
+                        log.warning("Server went silent, giving up")
+                        break
+                    last_packet = now
+                    self.send_nak(now, self.bitmap.num_segments)
+                elif self.next_nak is not None and now >= self.next_nak:
+                    self.send_nak(now, self.get_nak_limit())
+            if self.bitmap.is_complete():
+                for _ in range(self.DONE_REPEATS):
+                    self.send_control("DONE", {"session": self.session})
+                self.check_digest(download_file)
+        log.info(f"{self.naks} NAKs sent")
+        self.close_client()
+
+    def get_nak_limit(self):
+        # Segments past the highest one seen may still be on their way
+        if self.eof_received:
+            return self.bitmap.num_segments
+        return self.highest_seq + 1
+
+    def process_packet(self, packet, download_file, now):
+        packet_type, seq, payload, _ = WIRE_V2.parse_packet(packet)
+        if packet_type == DATA:
+            if seq >= self.bitmap.num_segments or seq in self.bitmap:
+                return
+            os.pwrite(download_file.fileno(), payload, seq * self.mss)
+            self.bitmap.add(seq)
+            if seq > self.highest_seq + 1:
+                self.schedule_nak(now)
+            self.highest_seq = max(self.highest_seq, seq)
+        elif packet_type == EOF and not self.eof_received:
+            self.eof_received = True
+            if not self.bitmap.is_complete():
+                self.schedule_nak(now)
+
+    def schedule_nak(self, now):
+        if self.next_nak is None:
+            self.next_nak = now + random.uniform(0, self.NAK_BACKOFF)
+
+    def send_nak(self, now, limit):
+        ranges = self.bitmap.missing_ranges(self.MAX_NAK_RANGES + 1, limit)
+        if not ranges:
+            self.next_nak = None
+            return
+        self.send_control(
+            "NAK",
+            {
+                "session": self.session,
+                # The stretched last range would ask for segments that did arrive
+                "ranges": ",".join(
+                    f"{start}-{end}" for start, end in ranges[: self.MAX_NAK_RANGES]
+                ),
+            },
+        )
+        self.naks += 1
+        self.next_nak = now + self.NAK_INTERVAL
+
+    def check_digest(self, download_file):
+        if self.digest is None:
+            return
+        file_digest = make_file_digest()
+        for offset in range(0, self.file_size, self.DIGEST_CHUNK):
+            file_digest.update(os.pread(download_file.fileno(), self.DIGEST_CHUNK, offset))
+        if file_digest.hexdigest() == self.digest:
+            log.info(f"File digest {self.digest} verified")
+        else:
+            log.warning(f"File digest mismatch, expected {self.digest} got {file_digest.hexdigest()}")
+
+    def close_client(self):
+        if self.data_socket is not self.control_socket:
+            self.data_socket.close()
+        self.control_socket.close()
+        log.info("Client closed...")
+
+
+def parse_address(text):
+    ip, _, port = text.rpartition(":")
+    return (ip, int(port))
+
+
+def read_args():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(
+        description="Receiver of a one-to-many file distribution over UDP."
+    )
+    parser.add_argument("server_ip", help="IP address of the server")
+    parser.add_argument("server_port", type=int, help="Port number of the server")
+    parser.add_argument(
+        "--group",
+        type=parse_address,
+        help="Multicast group (ip:port) the server sends to, the data comes unicast without it",
+    )
+    parser.add_argument(
+        "--interface", default="0.0.0.0", help="Address of the interface that joins the group"
+    )
+    parser.add_argument("--pref_outfile", default="", help="Prefix for the output file")
+    parser.add_argument(
+        "--log_level",
+        choices=sorted(LOG_LEVELS),
+        default="info",
+        help="Least severe messages that are printed",
+    )
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    return (
+        args.server_ip,
+        args.server_port,
+        args.group,
+        args.interface,
+        args.pref_outfile,
+    )
+
+
+if __name__ == "__main__":
+    # Run the client
+    client = MulticastClient(*read_args(), DOWNLOAD_FILE_NAME)
@@ -0,0 +1,310 @@
+import argparse
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import random
+import socket
+import time
+from utils import make_request, parse_request
+from batch_io import BatchIO
+from pacing import Pacer
+from wire import WIRE_V2
+from tracing import configure_logging, LOG_LEVELS
+
+SERVER_FILE_PATH = "./test/test_10MB.bin"
+
+log = logging.getLogger("mcast_server")
+
+
+class MulticastServer:
+    """
+    Pushes one file to many receivers at once. Every segment is sent once, to a
+    multicast group or, without one, to each receiver that joined in one batched
+    loop. Receivers NAK the segments they miss, the NAKs of all receivers are
+    merged and the repairs share the sending rate with new data, so the egress
+    grows with the file size and the loss, not with the number of receivers.
+
+    Receivers send JOIN to the server and get the file metadata (FILE) back, the
+    data packets use the v2 wire format and the EOF carries the file digest.
+    """
+
+    # Maximum Segment Size for each packet (in bytes)
+    MSS = 1400
+    # Buffer size for receiving control packets
+    BUFFER_SIZE = 2048
+    # Datagrams moved per recvmmsg/sendmmsg call
+    BATCH_SIZE = 64
+    # Segments the pacer lets go back to back
+    PACING_BURST = 10
+    # A segment repaired this recently is not repaired again for another NAK,
+    # the NAKs of the other receivers for the same loss are already answered
+    REPAIR_HOLDOFF = 0.05
+    # Period of the EOF once every segment went out at least once
+    EOF_INTERVAL = 0.5
+    # The transfer ends this long after the last NAK when receivers stay silent
+    LINGER = 3.0
+    # Longest sleep of the send loop
+    MAX_WAIT = 0.1
+
+    def __init__(self, server_ip, server_port, group, rate, ttl, min_receivers, join_wait):
+        self.server_ip = server_ip
+        self.server_port = server_port
+        # (ip, port) of the multicast group, None sends to every receiver
+        self.group = group
+        self.pacer = Pacer(self.PACING_BURST * self.MSS)
+        self.pacer.set_rate(rate * 125000, time.time())
+        # Receivers to wait for before the first segment, at most join_wait seconds
+        self.min_receivers = min_receivers
+        self.join_wait = join_wait
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server_socket.bind((self.server_ip, self.server_port))
+        if self.group is not None:
+            self.server_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            # Receivers on this host see the group traffic too
+            self.server_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            if self.server_ip != "0.0.0.0":
+                self.server_socket.setsockopt(
+                    socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.server_ip)
+                )
+        self.batch_io = BatchIO(self.server_socket, self.BATCH_SIZE, self.BUFFER_SIZE)
+        self.wire = WIRE_V2
+        # Identifies the transfer in every control message
+        self.session = random.getrandbits(32)
+        # Receiver address -> True once it has the whole file
+        self.receivers = {}
+        # Segments NAKed and not repaired yet, as a set and a heap that sends the
+        # lowest first, and when each was last repaired
+        self.pending_repairs = set()
+        self.repair_queue = []
+        self.repaired_at = {}
+        self.next_seq = 0
+        self.last_nak = 0
+        # Statistics
+        self.data_packets = 0
+        self.repair_packets = 0
+        self.naks = 0
+        self.bytes_sent = 0
+        log.info(f"Server listening on \t{self.server_ip}:{self.server_port}")
+
+    def open_file(self, file):
+        self.file_size = os.fstat(file.fileno()).st_size
+        if self.file_size == 0:
+            self.file_map = None
+            self.file_view = memoryview(b"")
+        else:
+            # Copy-on-write so ctypes can address the slices for sendmmsg
+            self.file_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+            self.file_view = memoryview(self.file_map)
+        self.num_segments = (self.file_size + self.MSS - 1) // self.MSS
+        self.digest = hashlib.md5(self.file_view).hexdigest()
+        self.metadata = make_request(
+            "FILE",
+            {
+                "session": self.session,
+                "size": self.file_size,
+                "mss": self.MSS,
+                "digest": self.digest,
+            },
+        )
+
+    def close_file(self):
+        self.file_view.release()
+        if self.file_map is not None:
+            self.file_map.close()
+
+    def get_targets(self):
+        if self.group is not None:
+            return [self.group]
+        return list(self.receivers)
+
+    def get_segment(self, seq):
+        offset = seq * self.MSS
+        return self.file_view[offset : offset + self.MSS]
+
+    def handle_control(self, packet, address, now):
+        command, options = parse_request(packet)
+        if command == "JOIN":
+            if address not in self.receivers:
+                self.receivers[address] = False
+                log.info(f"Receiver joined from \t{address[0]}:{address[1]}, {len(self.receivers)} receivers")
+            # A repeated JOIN means the metadata was lost
+            self.server_socket.sendto(self.metadata, address)
+            return
+        if options.get("session") != str(self.session):
+            return
+        if command == "NAK":
+            self.naks += 1
+            self.last_nak = now
+            ranges = options.get("ranges")
+            # A bare "ranges" flag is not a list of ranges
+            if isinstance(ranges, str):
+                self.add_repairs(ranges, now)
+        elif command == "DONE":
+            if not self.receivers.get(address):
+                log.info(f"Receiver {address[0]}:{address[1]} has the whole file")
+            self.receivers[address] = True
+
+    def add_repairs(self, ranges, now):
+        # Segments NAKed by several receivers are repaired once
+        for token in ranges.split(","):
+            start, _, end = token.partition("-")
+            # NAKs come from the network, a malformed range is skipped
+            try:
+                start, end = int(start), int(end)
+            except ValueError:
+                continue
+            for seq in range(start, min(end, self.next_seq)):
+                if seq in self.pending_repairs:
+                    continue
+                if now - self.repaired_at.get(seq, -self.REPAIR_HOLDOFF) >= self.REPAIR_HOLDOFF:
+                    self.pending_repairs.add(seq)
+                    heapq.heappush(self.repair_queue, seq)
+
+    def receive_control(self, timeout):
+        self.server_socket.settimeout(max(timeout, 0.0001))
+        try:
+            packet, address = self.server_socket.recvfrom(self.BUFFER_SIZE)
+        except socket.timeout:
+            return
+        now = time.time()
+        self.handle_control(packet, address, now)
+        # Drain every other control packet that is already queued
+        for packet, address in self.batch_io.recv_batch():
+            self.handle_control(packet, address, now)
+
+    def wait_for_receivers(self):
+        deadline = time.time() + self.join_wait
+        while len(self.receivers) < self.min_receivers and time.time() < deadline:
+            self.receive_control(deadline - time.time())
+        log.info(f"Starting with {len(self.receivers)} receivers")
+
+    def send_segments(self, seqs):
+        packets = []
+        for seq in seqs:
+            segment = self.get_segment(seq)
+            packets.append([self.wire.make_data_header(seq, segment), segment])
+            self.bytes_sent += len(segment)
+        for target in self.get_targets():
+            self.batch_io.send_batch(packets, target)
+
+    def send_allowed(self, now):
+        # Repairs first, in order, then new segments, within the pacer's allowance
+        allowance = self.pacer.get_allowance(now)
+        seqs = []
+        while self.repair_queue and allowance >= self.MSS and len(seqs) < self.BATCH_SIZE:
+            seq = heapq.heappop(self.repair_queue)
+            self.pending_repairs.discard(seq)
+            self.repaired_at[seq] = now
+            seqs.append(seq)
+            allowance -= self.MSS
+        self.repair_packets += len(seqs)
+        while self.next_seq < self.num_segments and allowance >= self.MSS and len(seqs) < self.BATCH_SIZE:
+            seqs.append(self.next_seq)
+            self.next_seq += 1
+            self.data_packets += 1
+            allowance -= self.MSS
+        if seqs:
+            self.send_segments(seqs)
+            self.pacer.consume(len(seqs) * self.MSS)
+
+    def send_eof(self):
+        eof_packet = self.wire.make_eof(self.num_segments, self.digest)
+        for target in self.get_targets():
+            self.server_socket.sendto(eof_packet, target)
+
+    def is_finished(self, now):
+        if self.next_seq < self.num_segments or self.pending_repairs:
+            return False
+        if self.receivers and all(self.receivers.values()):
+            return True
+        return now - self.last_nak >= self.LINGER
+
+    def send_file(self):
+        with open(SERVER_FILE_PATH, "rb") as f:
+            self.open_file(f)
+            self.wait_for_receivers()
+            start_time = time.time()
+            next_eof = 0
+            while True:
+                now = time.time()
+                self.send_allowed(now)
+                if self.next_seq == self.num_segments and not self.pending_repairs:
+                    if now >= next_eof:
+                        self.send_eof()
+                        next_eof = now + self.EOF_INTERVAL
+                        if self.last_nak < start_time:
+                            # The linger starts with the first EOF when nobody NAKed
+                            self.last_nak = now
+                    if self.is_finished(now):
+                        break
+                    wait = min(next_eof - now, self.MAX_WAIT)
+                else:
+                    wait = min(self.pacer.get_next_send_time(self.MSS) - now, self.MAX_WAIT)
+                self.receive_control(wait)
+            elapsed = time.time() - start_time
+            self.close_file()
+        done = sum(1 for complete in self.receivers.values() if complete)
+        log.info(f"Time taken to send file: {elapsed}s")
+        log.info(
+            f"{done} of {len(self.receivers)} receivers complete, {self.data_packets} data packets, "
+            f"{self.repair_packets} repairs ({self.repair_packets / max(self.data_packets, 1):.1%}), "
+            f"{self.naks} NAKs, {self.bytes_sent} payload bytes per target for a {self.file_size} byte file"
+        )
+
+
+def parse_address(text):
+    ip, _, port = text.rpartition(":")
+    return (ip, int(port))
+
+
+# Parse command-line arguments
+def read_args():
+    parser = argparse.ArgumentParser(
+        description="Reliable one-to-many file distribution over UDP with NAK based repair."
+    )
+    parser.add_argument("server_ip", help="IP address of the server")
+    parser.add_argument("server_port", type=int, help="Port number of the server")
+    parser.add_argument(
+        "--group",
+        type=parse_address,
+        help="Multicast group as ip:port, without it every receiver gets its own copy",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=100, help="Sending rate in Mbit/s, repairs included"
+    )
+    parser.add_argument("--ttl", type=int, default=1, help="Multicast TTL")
+    parser.add_argument(
+        "--receivers", type=int, default=1, help="Receivers to wait for before sending"
+    )
+    parser.add_argument(
+        "--join_wait",
+        type=float,
+        default=10,
+        help="Longest wait (s) for the receivers, late ones NAK what they missed",
+    )
+    parser.add_argument(
+        "--log_level",
+        choices=sorted(LOG_LEVELS),
+        default="info",
+        help="Least severe messages that are printed",
+    )
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    return (
+        args.server_ip,
+        args.server_port,
+        args.group,
+        args.rate,
+        args.ttl,
+        args.receivers,
+        args.join_wait,
+    )
+
+
+if __name__ == "__main__":
+    # Run the server
+    server = MulticastServer(*read_args())
+    server.send_file()
+    log.info(f"Server closed...")
@@ -0,0 +1,392 @@
+import argparse
+import bisect
+import os
+import select
+import socket
+import sys
+import threading
+import time
+
+# Prepended to every metric name
+PREFIX = "udp_transfer_"
+# Upper bounds (s) of the RTT histogram buckets
+RTT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+# Kinds of retransmission counted by the sender
+RETRANSMIT_KINDS = ("timeout", "fast", "sack", "partial")
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get_value(self):
+        return self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get_value(self):
+        return self.value
+
+
+class Rate:
+    """
+    Gauge of how fast a counter grows, averaged over the last `window` seconds.
+    It is computed when scraped, so a stalled transfer reads 0 instead of the
+    last rate it reached.
+    """
+
+    def __init__(self, counter, window):
+        self.counter = counter
+        self.window = window
+        self.window_start = time.time()
+        self.window_value = counter.value
+        self.rate = 0.0
+
+    def get_value(self):
+        now = time.time()
+        elapsed = now - self.window_start
+        if elapsed >= self.window:
+            self.rate = (self.counter.value - self.window_value) / elapsed
+            self.window_start = now
+            self.window_value = self.counter.value
+        return self.rate
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket plus +Inf, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    ]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms of the running transfers, rendered in the
+    Prometheus text format. Metrics are created once per label set, updating
+    one is a plain attribute update with no lock; only creation and rendering
+    lock, since the exporter renders from its own thread.
+    """
+
+    def __init__(self):
+        # name -> (type, help, {sorted label items: metric})
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def get_metric(self, name, kind, help_text, labels, make):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.setdefault(PREFIX + name, (kind, help_text, {}))
+            if family[0] != kind:
+                raise ValueError(f"{name} is already a {family[0]}")
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = make()
+        return metric
+
+    def remove_session(self, session):
+        # Drops every series of a finished session, and the families left empty
+        with self.lock:
+            for name, (_, _, metrics) in list(self.families.items()):
+                for labels in [labels for labels in metrics if ("session", session) in labels]:
+                    del metrics[labels]
+                if not metrics:
+                    del self.families[name]
+
+    def counter(self, name, help_text, **labels):
+        return self.get_metric(name, "counter", help_text, labels, Counter)
+
+    def gauge(self, name, help_text, **labels):
+        return self.get_metric(name, "gauge", help_text, labels, Gauge)
+
+    def rate(self, name, help_text, counter, window=1.0, **labels):
+        return self.get_metric(name, "gauge", help_text, labels, lambda: Rate(counter, window))
+
+    def histogram(self, name, help_text, buckets=RTT_BUCKETS, **labels):
+        return self.get_metric(name, "histogram", help_text, labels, lambda: Histogram(buckets))
+
+    def render(self):
+        with self.lock:
+            families = [
+                (name, kind, help_text, list(metrics.items()))
+                for name, (kind, help_text, metrics) in sorted(self.families.items())
+            ]
+        lines = []
+        for name, kind, help_text, metrics in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                if kind == "histogram":
+                    lines += self.render_histogram(name, labels, metric)
+                else:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(metric.get_value())}")
+        return "\n".join(lines) + "\n"
+
+    def render_histogram(self, name, labels, histogram):
+        lines = []
+        cumulative = 0
+        bounds = [format_value(bound) for bound in histogram.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, histogram.counts):
+            cumulative += count
+            bucket_labels = format_labels(labels + (("le", bound),))
+            lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{name}_sum{format_labels(labels)} {format_value(histogram.sum)}")
+        lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return lines
+
+
+class SessionMetrics:
+    """
+    Metrics labelled with one session, dropped from the registry by close() when
+    the transfer ends so a long running program does not keep every session.
+    """
+
+    def __init__(self, registry, session):
+        self.registry = registry
+        self.session = session
+
+    def close(self, exporter):
+        if exporter is None:
+            self.registry.remove_session(self.session)
+        else:
+            exporter.end_session(self.session)
+
+
+class SenderMetrics(SessionMetrics):
+    """
+    Metrics of one sending session, labelled with the client's address.
+    """
+
+    def __init__(self, registry, session):
+        super().__init__(registry, session)
+        labels = {"session": session}
+        self.packets_sent = registry.counter(
+            "packets_sent_total", "Data packets sent, retransmissions included", **labels
+        )
+        self.bytes_sent = registry.counter(
+            "bytes_sent_total", "Payload bytes sent, retransmissions included", **labels
+        )
+        self.retransmits = {
+            kind: registry.counter(
+                "retransmits_total", "Retransmitted data packets by cause", kind=kind, **labels
+            )
+            for kind in RETRANSMIT_KINDS
+        }
+        self.timeouts = registry.counter(
+            "timeouts_total", "Retransmission timer expiries", **labels
+        )
+        self.acked_bytes = registry.counter(
+            "acked_bytes_total", "Bytes taken out of flight by cumulative ACKs", **labels
+        )
+        self.goodput = registry.rate(
+            "goodput_bytes_per_second", "Acked bytes per second", self.acked_bytes, **labels
+        )
+        self.cwnd = registry.gauge("cwnd_bytes", "Congestion window", **labels)
+        self.bytes_in_flight = registry.gauge(
+            "bytes_in_flight", "Bytes sent and not acked", **labels
+        )
+        self.srtt = registry.gauge("srtt_seconds", "Smoothed round trip time", **labels)
+        self.min_rtt = registry.gauge(
+            "min_rtt_seconds", "Lowest round trip time of the last 10 seconds", **labels
+        )
+        self.rto = registry.gauge("rto_seconds", "Retransmission timeout", **labels)
+        self.rtt = registry.histogram("rtt_seconds", "Round trip time samples", **labels)
+
+
+class ReceiverMetrics(SessionMetrics):
+    """
+    Metrics of one receiving session, labelled with the server's address (and
+    the start of the byte range for a parallel stream).
+    """
+
+    def __init__(self, registry, session):
+        super().__init__(registry, session)
+        labels = {"session": session}
+        self.packets_received = registry.counter(
+            "packets_received_total", "Data packets received, duplicates included", **labels
+        )
+        self.bytes_received = registry.counter(
+            "bytes_received_total", "Payload bytes received, duplicates included", **labels
+        )
+        self.receive_rate = registry.rate(
+            "receive_bytes_per_second", "Payload bytes received per second", self.bytes_received, **labels
+        )
+        self.duplicates = registry.counter(
+            "duplicates_total", "Data packets that were already received", **labels
+        )
+        self.corrupt = registry.counter(
+            "corrupt_total", "Packets dropped for a bad checksum or header", **labels
+        )
+        self.acks_sent = registry.counter("acks_sent_total", "ACKs sent", **labels)
+        self.expected_seq = registry.gauge(
+            "expected_seq", "Next segment expected in order", **labels
+        )
+
+
+class MetricsExporter:
+    """
+    Exposes a registry from a daemon thread: every connection to the UNIX
+    socket `socket_path` gets the current metrics in the Prometheus text
+    format, and `textfile` is rewritten every `interval` seconds for the
+    node exporter's textfile collector. A session that ended is dropped once
+    the textfile holds its final values.
+    """
+
+    # Longest the thread sleeps before checking whether it should stop
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, registry, socket_path=None, textfile=None, interval=5.0):
+        self.registry = registry
+        self.socket_path = socket_path
+        self.textfile = textfile
+        self.interval = interval
+        self.listener = None
+        self.thread = None
+        self.stopped = threading.Event()
+        # Sessions that ended since the last textfile write
+        self.ended_sessions = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.socket_path is not None:
+            # A socket left behind by a previous run
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener.bind(self.socket_path)
+            self.listener.listen(8)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        next_write = time.time()
+        while not self.stopped.is_set():
+            now = time.time()
+            if self.textfile is not None and now >= next_write:
+                self.write_textfile()
+                next_write = now + self.interval
+            wait = self.POLL_INTERVAL
+            if self.textfile is not None:
+                wait = min(wait, max(next_write - now, 0))
+            if self.listener is None:
+                self.stopped.wait(wait)
+                continue
+            readable, _, _ = select.select([self.listener], [], [], wait)
+            if readable:
+                self.serve_scrape()
+
+    def serve_scrape(self):
+        connection, _ = self.listener.accept()
+        try:
+            connection.sendall(self.registry.render().encode())
+        except OSError:
+            pass
+        finally:
+            connection.close()
+
+    def end_session(self, session):
+        if self.textfile is None:
+            # Scrapes only ever see the live sessions
+            self.registry.remove_session(session)
+            return
+        with self.lock:
+            self.ended_sessions.append(session)
+
+    def write_textfile(self):
+        with self.lock:
+            ended_sessions = self.ended_sessions
+            self.ended_sessions = []
+        # Renamed into place so the collector never reads a partial file
+        temporary = f"{self.textfile}.tmp"
+        with open(temporary, "w") as f:
+            f.write(self.registry.render())
+        os.replace(temporary, self.textfile)
+        for session in ended_sessions:
+            self.registry.remove_session(session)
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        # The final values of the transfer
+        if self.textfile is not None:
+            self.write_textfile()
+        if self.listener is not None:
+            self.listener.close()
+            os.unlink(self.socket_path)
+
+
+def add_metrics_args(parser):
+    parser.add_argument(
+        "--metrics_socket", help="Serve live metrics on this UNIX socket (read with metrics.py)"
+    )
+    parser.add_argument(
+        "--metrics_file", help="Write live metrics to this Prometheus textfile"
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        type=float,
+        default=5.0,
+        help="Seconds between rewrites of the metrics textfile",
+    )
+
+
+def make_exporter(args):
+    # None unless the metrics are exported somewhere
+    if args.metrics_socket is None and args.metrics_file is None:
+        return None
+    return MetricsExporter(
+        MetricsRegistry(), args.metrics_socket, args.metrics_file, args.metrics_interval
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the live metrics of a client or server (--metrics_socket)."
+    )
+    parser.add_argument("socket_path", help="UNIX socket of the running program")
+    args = parser.parse_args()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(args.socket_path)
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                break
+            sys.stdout.write(data.decode())
+
+
+if __name__ == "__main__":
+    main()
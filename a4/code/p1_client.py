@@ -1,31 +1,113 @@
 import argparse
+import copy
+import json
+import logging
+import os
 import socket
-from utils import parse_packet
+import threading
+import time
+from utils import (
+    make_request,
+    parse_reply,
+    parse_error,
+    get_timestamp,
+    MAX_HEADER_SIZE,
+)
+from bitmap import SackRanges, SegmentBitmap
+from ack_policy import AckPolicy
+from pmtu import MAX_PAYLOAD, make_probe, parse_probe
+from compress import get_codecs, make_decompressor
+from integrity import get_checksums, make_checksum, make_file_digest
+from wire import WIRES, DATA, EOF
+from tracing import (
+    Tracer,
+    configure_logging,
+    LOG_LEVELS,
+    RECV,
+    DUPLICATE,
+    CORRUPT,
+    ACK_SENT,
+    EOF as EOF_EVENT,
+)
 
 DOWNLOAD_FILE_NAME = "downloaded_file.bin"
+# Default number of SACK ranges carried in each ACK
+MAX_SACK_BLOCKS = 4
+
+log = logging.getLogger("p1_client")
 
 
 class Client:
-    def __init__(self, server_ip, server_port, download_file_name):
+    def __init__(self, server_ip, server_port, max_sack_blocks, ack_policy, pwrite, streams, resume, pmtu, compress, verify, wire, file_name, trace_path, download_file_name, byte_range=None):
 
         # Constants
         # Maximum Segment Size
         self.MSS = 1400
         # Buffer Size
         self.BUFFER_SIZE = self.MSS + 1000
+        # Seconds without any packet before the client re-sends its ACK
+        self.RECV_TIMEOUT = 2
+        # Seconds between saves of the received bitmap when resuming is enabled
+        self.SAVE_INTERVAL = 1.0
+        # Missing ranges listed in a resuming GET, the last one runs to the end of the file
+        self.MAX_NEED_RANGES = 40
+        # Datagrams the socket buffer should hold when the segments are large, the
+        # kernel caps it at net.core.rmem_max
+        self.RECV_BUFFER_SEGMENTS = 64
+        # Bytes read back per call when hashing segments that were written out of order
+        self.DIGEST_CHUNK = 1 << 20
 
         self.server_ip = server_ip
         self.server_port = server_port
+        # Number of SACK ranges appended to every ACK (0 sends plain cumulative ACKs)
+        self.max_sack_blocks = max_sack_blocks
+        # When to ACK in order packets (every Nth, after a delay, adaptive)
+        self.ack_policy = ack_policy
+        # Write every segment at its offset as it arrives instead of reordering in memory
+        self.pwrite = pwrite or resume or byte_range is not None
+        # Number of sockets fetching disjoint ranges of the file in parallel
+        self.streams = streams
+        # (start, end) bytes fetched by this client when it is one of the streams
+        self.byte_range = byte_range
+        self.range_start = 0 if byte_range is None else byte_range[0]
+        # Keep the received bitmap next to the output so an interrupted download can
+        # continue where it stopped
+        self.resume = resume
+        # Let the server probe the path and size its segments to the path MTU
+        self.pmtu = pmtu
+        # Offer compression codecs, only when writing in order since the offsets in
+        # the output are unknown until the stream is decompressed
+        self.compress = compress and not self.pwrite
+        # Check the segment checksums and the file digest sent with the EOF
+        self.verify = verify
+        # Packet format, the server answers in the format of the GET
+        self.wire = wire
+        # Name of the file in the server's catalog, None for its default file
+        self.file_name = file_name
+        # Binary event trace file, every stream records to its own
+        self.trace_path = trace_path
+        # Per packet messages are only formatted when they are logged
+        self.debug = log.isEnabledFor(logging.DEBUG)
 
         # Initialize UDP socket
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # Set timeout for server response
-        self.client_socket.settimeout(2)
+        self.client_socket.settimeout(self.RECV_TIMEOUT)
 
         # Output File
+        self.download_file_name = download_file_name
         self.output_filename = f"{download_file_name}"
+        self.partial_filename = f"{self.output_filename}.part"
         self.eof_received = False
-        self.receive_file()
+        if self.streams > 1:
+            self.receive_file_parallel()
+        else:
+            self.tracer = self.make_tracer()
+            try:
+                self.receive_file()
+            finally:
+                if self.tracer is not None:
+                    self.tracer.close()
 
     def receive_file(self):
         """
@@ -34,21 +116,53 @@ class Client:
         """
         # Process Variables
         self.buffer = {}
+        # Out of order segments, kept as ranges for the SACK blocks
+        self.sack_ranges = SackRanges(self.max_sack_blocks)
         self.expected_ack_num = 0
+        # Received segments in pwrite mode, created once the file size is known
+        self.bitmap = None
+        # (send timestamp, receive timestamp) of the newest timestamped packet, echoed in ACKs
+        self.timestamp_echo = None
+        # Decompresses the in order segments when the server compresses the file
+        self.decompressor = None
+        # Segment checksum of the server, None when the packets carry none
+        self.checksum = None
+        # Digest of the output so far, it covers the segments below digest_upto
+        self.file_digest = make_file_digest() if self.verify else None
+        self.digest_upto = 0
+        # Identity of the served file, only set when the download can be resumed
+        self.identity = None
+        self.last_save = 0
+        self.partial = self.load_partial() if self.resume else None
 
-        with open(self.output_filename, "wb") as download_file:
+        # A stream writes into the file its parent already sized
+        mode = "wb" if self.byte_range is None and self.partial is None else "r+b"
+        with open(self.output_filename, mode) as download_file:
 
             # Ping Server to Send File
 
             while True:
 
                 try:
-                    print(f"{self.server_ip}:{self.server_port} /GET")
+                    log.info(f"{self.server_ip}:{self.server_port} /GET")
                     self.client_socket.sendto(
-                        "GET".encode(), (self.server_ip, self.server_port)
+                        self.make_get_request(), (self.server_ip, self.server_port)
                     )
-                    print("Downloading file from server")
-                    packet, _ = self.client_socket.recvfrom(self.BUFFER_SIZE)
+                    log.info("Downloading file from server")
+                    packet, address = self.client_socket.recvfrom(self.BUFFER_SIZE)
+                    # The server probes the path before it replies
+                    while self.answer_probe(packet, address):
+                        packet, address = self.client_socket.recvfrom(self.BUFFER_SIZE)
+                    error = parse_error(packet)
+                    if error is not None:
+                        log.warning(f"Server refused the request: {error}")
+                        self.close_client()
+                        return
+                    if self.pwrite or self.pmtu or self.compress or self.verify or self.file_name:
+                        # Wait for the file metadata before accepting any data
+                        if self.handle_metadata(packet, download_file):
+                            break
+                        continue
                     self.process_packet(
                         packet,
                         download_file,
@@ -61,11 +175,23 @@ class Client:
             time_out_counter = 0
             while True:
                 if time_out_counter > 10:
+                    if self.identity is not None:
+                        self.save_partial(download_file)
                     self.close_client()
                     break
+                # Wake up in time for a delayed ACK
+                self.client_socket.settimeout(
+                    self.ack_policy.get_wait(self.RECV_TIMEOUT, time.time())
+                )
                 try:
-                    packet, _ = self.client_socket.recvfrom(self.BUFFER_SIZE)
+                    packet, address = self.client_socket.recvfrom(self.BUFFER_SIZE)
                     time_out_counter = 0
+                    if self.answer_probe(packet, address):
+                        continue
+                    if parse_reply(packet) is not None:
+                        # Our confirmation of the metadata was lost
+                        self.send_ack_to_server(self.expected_ack_num)
+                        continue
                     self.process_packet(
                         packet,
                         download_file,
@@ -73,65 +199,377 @@ class Client:
                     if self.eof_received:
                         break
                 except socket.timeout:
+                    if self.ack_policy.is_pending():
+                        # The delayed ACK is due, this is not an idle timeout
+                        self.send_ack_to_server(self.expected_ack_num)
+                        continue
                     time_out_counter += 1
                     self.send_ack_to_server(self.expected_ack_num)
         self.client_socket.close()
 
+    def make_tracer(self):
+        if self.trace_path is None:
+            return None
+        if self.byte_range is None:
+            return Tracer(self.trace_path)
+        # Suffixed with the start of the stream's byte range
+        return Tracer(f"{self.trace_path}.{self.range_start}")
+
+    def request_file_stat(self):
+        # Ask for the file and segment size without starting a transfer
+        options = {} if self.file_name is None else {"file": self.file_name}
+        for _ in range(10):
+            self.client_socket.sendto(
+                make_request("STAT", options), (self.server_ip, self.server_port)
+            )
+            try:
+                packet, _ = self.client_socket.recvfrom(self.BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            error = parse_error(packet)
+            if error is not None:
+                log.warning(f"Server refused the request: {error}")
+                return None, None
+            options = parse_reply(packet)
+            if options is not None:
+                return int(options["size"]), int(options["mss"])
+        return None, None
+
+    def receive_file_parallel(self):
+        """
+        Fetch the file over several sockets, each one downloading a disjoint byte
+        range straight into its place in the output file.
+        """
+        file_size, mss = self.request_file_stat()
+        self.client_socket.close()
+        if file_size is None:
+            log.warning("Server did not answer STAT")
+            return
+        # Ranges are made of whole segments so every stream sends full packets
+        num_segments = (file_size + mss - 1) // mss
+        range_size = max(1, (num_segments + self.streams - 1) // self.streams) * mss
+        byte_ranges = [
+            (start, min(start + range_size, file_size))
+            for start in range(0, file_size, range_size)
+        ]
+        with open(self.output_filename, "wb") as download_file:
+            self.preallocate(download_file, file_size)
+        streams = []
+
+        def run_stream(byte_range):
+            streams.append(
+                Client(
+                    self.server_ip,
+                    self.server_port,
+                    *self.get_stream_args(),
+                    byte_range=byte_range,
+                )
+            )
+
+        threads = [
+            threading.Thread(target=run_stream, args=(byte_range,))
+            for byte_range in byte_ranges
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.eof_received = len(streams) == len(byte_ranges) and all(
+            stream.eof_received for stream in streams
+        )
+        log.info(f"{len(byte_ranges)} streams done, complete: {self.eof_received}")
+
+    def get_stream_args(self):
+        # Every stream gets its own ACK policy state and writes in pwrite mode
+        return (
+            self.max_sack_blocks,
+            copy.copy(self.ack_policy),
+            True,
+            1,
+            False,
+            self.pmtu,
+            False,
+            self.verify,
+            self.wire,
+            self.file_name,
+            self.trace_path,
+            self.download_file_name,
+        )
+
+    def preallocate(self, download_file, file_size):
+        # Reserve the whole file up front so positional writes never extend it
+        os.ftruncate(download_file.fileno(), file_size)
+        if hasattr(os, "posix_fallocate") and file_size > 0:
+            os.posix_fallocate(download_file.fileno(), 0, file_size)
+
+    def make_get_request(self):
+        options = {}
+        if self.file_name is not None:
+            options["file"] = self.file_name
+        if self.pwrite:
+            options["meta"] = True
+        if self.pmtu:
+            # Largest datagram this client takes
+            options["mtu"] = MAX_PAYLOAD
+        if self.compress:
+            options["codecs"] = ",".join(get_codecs())
+        if self.verify:
+            options["checksums"] = ",".join(get_checksums())
+            options["verify"] = True
+        if self.byte_range is not None:
+            options["range"] = f"{self.byte_range[0]}-{self.byte_range[1]}"
+        if self.partial is not None:
+            # Only ask for what is missing, the server checks it is still the same file
+            identity, bitmap = self.partial
+            options["digest"] = identity["digest"]
+            options["mss"] = identity["mss"]
+            if self.pmtu:
+                # Same segments as before unless the path got narrower
+                options["mtu"] = identity["mss"] + MAX_HEADER_SIZE
+            options["need"] = ",".join(
+                f"{start}-{end}" for start, end in bitmap.missing_ranges(self.MAX_NEED_RANGES)
+            )
+        return self.wire.make_get(options)
+
+    def load_partial(self):
+        # (identity, bitmap) saved by an interrupted download, None if there is none
+        if not os.path.exists(self.output_filename):
+            return None
+        try:
+            with open(self.partial_filename, "rb") as f:
+                identity = json.loads(f.readline())
+                num_segments = (identity["size"] + identity["mss"] - 1) // identity["mss"]
+                bitmap = SegmentBitmap.from_bytes(num_segments, f.read())
+        except (OSError, ValueError, KeyError):
+            return None
+        return identity, bitmap
+
+    def save_partial(self, download_file):
+        # Segments reach the disk before the bitmap that claims them, the bitmap is
+        # replaced atomically so a crash leaves either the old or the new one
+        os.fsync(download_file.fileno())
+        temp_filename = f"{self.partial_filename}.tmp"
+        with open(temp_filename, "wb") as f:
+            f.write(json.dumps(self.identity).encode() + b"\n")
+            f.write(self.bitmap.to_bytes())
+        os.replace(temp_filename, self.partial_filename)
+        self.last_save = time.time()
+
+    def size_receive_buffer(self):
+        # Never shrink the default buffer
+        size = self.RECV_BUFFER_SEGMENTS * self.BUFFER_SIZE
+        if size > self.client_socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF):
+            self.client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+
+    def answer_probe(self, packet, address):
+        # Echo path MTU probes, returns False for any other packet
+        size = parse_probe(packet)
+        if size is None:
+            return False
+        self.client_socket.sendto(make_probe(size, padded=False), address)
+        return True
+
+    def handle_metadata(self, packet, download_file):
+        options = parse_reply(packet)
+        if options is None:
+            return False
+        file_size = int(options["size"])
+        # Offsets follow the server's segment size
+        self.MSS = int(options["mss"])
+        self.BUFFER_SIZE = min(self.MSS + 1000, 65536)
+        self.size_receive_buffer()
+        if "checksum" in options:
+            self.checksum = make_checksum(options["checksum"])
+        # Bytes this client writes
+        self.data_size = file_size
+        if not self.pwrite:
+            if "codec" in options:
+                self.decompressor = make_decompressor(options["codec"])
+                log.info(f"Server compresses the file with {options['codec']}")
+            log.info(f"Segment size {self.MSS}")
+            self.send_ack_to_server(self.expected_ack_num)
+            return True
+        identity = {"size": file_size, "mss": self.MSS, "digest": options.get("digest")}
+        if self.partial is not None and self.partial[0] == identity:
+            self.bitmap = self.partial[1]
+            self.expected_ack_num = self.bitmap.next_missing(0)
+            log.info(f"Resuming, {self.bitmap.count} of {self.bitmap.num_segments} segments already downloaded")
+        else:
+            self.bitmap = SegmentBitmap((file_size + self.MSS - 1) // self.MSS)
+            if self.byte_range is None:
+                self.preallocate(download_file, file_size)
+        # Without a digest from the server there is no way to tell the file changed
+        if self.resume and identity["digest"] is not None:
+            self.identity = identity
+        log.info(f"File size {file_size}, {self.bitmap.num_segments} segments")
+        # ACK 0 confirms the metadata and starts the transfer
+        self.send_ack_to_server(self.expected_ack_num)
+        return True
+
+    def write_segment(self, seq_num, data, download_file, now):
+        # Returns True when the ACK should be sent at once
+        if seq_num < self.expected_ack_num or seq_num >= self.bitmap.num_segments or seq_num in self.bitmap:
+            if self.debug:
+                log.debug(f"dropped duplicate packet seq: {seq_num}")
+            if self.tracer is not None:
+                self.tracer.record(DUPLICATE, seq_num)
+            return True
+        os.pwrite(download_file.fileno(), data, self.range_start + seq_num * self.MSS)
+        self.bitmap.add(seq_num)
+        if self.identity is not None and now - self.last_save >= self.SAVE_INTERVAL:
+            self.save_partial(download_file)
+        if seq_num != self.expected_ack_num:
+            if self.debug:
+                log.debug(
+                    f"Out of Order - Expected : {self.expected_ack_num}, Received:  {seq_num}"
+            )
+            self.sack_ranges.add(seq_num)
+            return True
+        self.expected_ack_num = self.bitmap.next_missing(seq_num)
+        self.sack_ranges.advance(self.expected_ack_num)
+        self.advance_digest(download_file)
+        # A gap fill moves expected_ack_num by more than one
+        if self.expected_ack_num == seq_num + 1:
+            return self.ack_policy.on_in_order(now)
+        return True
+
+    def write_in_order(self, seq, data, download_file):
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        self.write_output(data, download_file)
+
+    def write_output(self, data, download_file):
+        download_file.write(data)
+        if self.file_digest is not None:
+            self.file_digest.update(data)
+
+    def advance_digest(self, download_file):
+        # Hash the segments that just became contiguous, still in the page cache
+        if self.file_digest is None:
+            return
+        start = self.digest_upto * self.MSS
+        end = min(self.expected_ack_num * self.MSS, self.data_size)
+        while start < end:
+            chunk = os.pread(
+                download_file.fileno(),
+                min(end - start, self.DIGEST_CHUNK),
+                self.range_start + start,
+            )
+            if not chunk:
+                break
+            self.file_digest.update(chunk)
+            start += len(chunk)
+        self.digest_upto = self.expected_ack_num
+
+    def check_digest(self, digest, download_file):
+        if self.file_digest is None:
+            return
+        if digest is None:
+            log.warning("Server sent no file digest")
+            return
+        if self.bitmap is not None:
+            self.advance_digest(download_file)
+        if self.file_digest.hexdigest() == digest:
+            log.info(f"File digest {digest} verified")
+        else:
+            log.warning(f"File digest mismatch, expected {digest} got {self.file_digest.hexdigest()}")
+
     def process_packet(self, packet, download_file):
-        seq_num, data = parse_packet(packet)
-        if data == b"EOF":
-            print("EOF Recieved")
+        packet_type, seq_num, data, timestamp = self.wire.parse_packet(packet, self.checksum, self.verify)
+        if packet_type != DATA and packet_type != EOF:
+            # Ask for it again at once, the duplicate ACK counts towards a fast retransmit
+            if self.debug:
+                log.debug("Corrupted packet dropped")
+            if self.tracer is not None:
+                self.tracer.record(CORRUPT, -1)
+            self.send_ack_to_server(self.expected_ack_num)
+            return
+        if timestamp is not None:
+            self.timestamp_echo = (timestamp, get_timestamp())
+        if packet_type == DATA and self.tracer is not None:
+            self.tracer.record(RECV, seq_num)
+        now = time.time()
+        self.ack_policy.on_arrival(now)
+        # Out of order packets, duplicates and gap fills are ACKed at once
+        ack_now = True
+        if packet_type == EOF:
+            log.info("EOF Recieved")
+            if self.tracer is not None:
+                self.tracer.record(EOF_EVENT, seq_num)
+            if self.decompressor is not None:
+                self.write_output(self.decompressor.flush(), download_file)
+            # The payload of the EOF is the file digest
+            self.check_digest(data, download_file)
             self.expected_ack_num += 1
             self.handle_eof_recv()  # send ACK for this EOF to the server
             return
+        elif self.bitmap is not None:
+            ack_now = self.write_segment(seq_num, data, download_file, now)
         # Expected/Desired Packet
         elif seq_num == self.expected_ack_num:
 
-            download_file.write(data)
+            self.write_in_order(seq_num, data, download_file)
             self.expected_ack_num += 1
+            if self.expected_ack_num not in self.buffer:
+                ack_now = self.ack_policy.on_in_order(now)
             # Write Existing in Buffer
             while self.expected_ack_num in self.buffer:
                 # This is where the
                 data = self.buffer.pop(self.expected_ack_num)
 
-                print("Writing from buffer to the file ", data)
-                download_file.write(data)
+                if self.debug:
+                    log.debug(f"Writing from buffer to the file seq {self.expected_ack_num}")
+                self.write_in_order(self.expected_ack_num, data, download_file)
                 self.expected_ack_num += 1
+            self.sack_ranges.advance(self.expected_ack_num)
         # Out of Order Packet
         elif seq_num > self.expected_ack_num:
-            print(
-                f"Out of Order - Expected : {self.expected_ack_num}, Received:  {seq_num}"
-            )
+            if self.debug:
+                log.debug(
+                    f"Out of Order - Expected : {self.expected_ack_num}, Received:  {seq_num}"
+                )
             if seq_num not in self.buffer:
                 self.buffer[seq_num] = data
+                self.sack_ranges.add(seq_num)
         else:
-            print(f"dropped duplicate packet seq: {seq_num}")
+            if self.debug:
+                log.debug(f"dropped duplicate packet seq: {seq_num}")
+            if self.tracer is not None:
+                self.tracer.record(DUPLICATE, seq_num)
 
         # Send Ack to Server
-        self.send_ack_to_server(self.expected_ack_num)
-        print(
-            f"Recieves seq {seq_num}\t, ACK for seq {self.expected_ack_num}, Expecting seq {self.expected_ack_num}"
-        )
+        if self.debug:
+            log.debug(f"Recieves seq {seq_num}\t, Expecting seq {self.expected_ack_num}")
+        if ack_now:
+            self.send_ack_to_server(self.expected_ack_num)
         return
 
     def send_ack_to_server(self, seq_to_be_acked):
-        segment = seq_to_be_acked.to_bytes(4, "big")
+        # Out of order packets are reported as SACK ranges
+        sack_blocks = self.sack_ranges.blocks(self.max_sack_blocks)
+        segment = self.wire.make_ack(seq_to_be_acked, sack_blocks, self.timestamp_echo)
         self.client_socket.sendto(segment, (self.server_ip, self.server_port))
-        print("ACK Sent", seq_to_be_acked)
+        self.ack_policy.on_ack_sent()
+        if self.debug:
+            log.debug(f"ACK Sent {seq_to_be_acked} {sack_blocks}")
+        if self.tracer is not None:
+            self.tracer.record(ACK_SENT, seq_to_be_acked)
 
 
     def handle_eof_recv(self):
         self.eof_received = True
+        if self.identity is not None and os.path.exists(self.partial_filename):
+            os.remove(self.partial_filename)
         # send ACK for this EOF to the server
         self.send_ack_to_server(self.expected_ack_num)
-        print("Final Ack Sent")
+        log.info("Final Ack Sent")
         self.close_client()
-        print("File downloaded successfully")
+        log.info("File downloaded successfully")
         return
 
     def close_client(self):
         self.client_socket.close()
-        print("Client Socket Closed")
+        log.info("Client Socket Closed")
 
 
 def read_args():
@@ -139,8 +577,92 @@ def read_args():
     parser = argparse.ArgumentParser(description="Reliable file receiver over UDP.")
     parser.add_argument("server_ip", help="IP address of the server")
     parser.add_argument("server_port", type=int, help="Port number of the server")
+    parser.add_argument(
+        "--sack_blocks",
+        type=int,
+        default=MAX_SACK_BLOCKS,
+        help="Maximum number of SACK ranges per ACK (0 to disable)",
+    )
+    parser.add_argument(
+        "--ack_every", type=int, default=1, help="ACK every Nth in order packet"
+    )
+    parser.add_argument(
+        "--ack_delay",
+        type=float,
+        default=40,
+        help="Longest delay (ms) of an ACK for in order packets",
+    )
+    parser.add_argument(
+        "--adaptive_ack",
+        action="store_true",
+        help="Scale the ACK frequency with the packet arrival rate",
+    )
+    parser.add_argument(
+        "--pwrite",
+        action="store_true",
+        help="Write segments at their offset in a preallocated file",
+    )
+    parser.add_argument(
+        "--streams",
+        type=int,
+        default=1,
+        help="Number of sockets downloading disjoint ranges in parallel",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted download from the bitmap saved next to the output",
+    )
+    parser.add_argument(
+        "--pmtu",
+        action="store_true",
+        help="Negotiate the segment size from a path MTU probe",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Let the server compress the file (zlib, lz4 or zstd), not with --pwrite",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Checksum every segment and verify the file digest sent with the EOF",
+    )
+    parser.add_argument(
+        "--wire",
+        type=int,
+        choices=sorted(WIRES),
+        default=1,
+        help="Packet format, 2 is the fixed binary header",
+    )
+    parser.add_argument(
+        "--file", help="Name of the file to download from the server's directory"
+    )
+    parser.add_argument(
+        "--log_level",
+        choices=sorted(LOG_LEVELS),
+        default="info",
+        help="debug logs every packet, which slows the transfer down",
+    )
+    parser.add_argument("--trace", help="Record binary transfer events to this file")
     args = parser.parse_args()
-    return (args.server_ip, args.server_port)
+    configure_logging(args.log_level)
+    ack_policy = AckPolicy(args.ack_every, args.ack_delay / 1000, args.adaptive_ack)
+    return (
+        args.server_ip,
+        args.server_port,
+        args.sack_blocks,
+        ack_policy,
+        args.pwrite,
+        args.streams,
+        args.resume,
+        args.pmtu,
+        args.compress,
+        args.verify,
+        WIRES[args.wire],
+        args.file,
+        args.trace,
+    )
 
 
 if __name__ == "__main__":
@@ -6,7 +6,6 @@ from mininet.cli import CLI
 from mininet.log import setLogLevel
 import time, re, os
 import sys
-import hashlib
 
 
 class CustomTopo(Topo):
@@ -26,18 +25,16 @@ class CustomTopo(Topo):
         self.addLink(h2, s1, loss=0, bw=50)
 
 
-def compute_md5(file_path):
-    """Compute the MD5 hash of a file."""
-    hasher = hashlib.md5()
+def read_verified_digest(log_file):
+    """Return the file MD5 the client verified against the server's, None if it did not."""
     try:
-        with open(file_path, "rb") as file:
-            # Read the file in chunks to avoid using too much memory for large files
-            while chunk := file.read(8192):
-                hasher.update(chunk)
-        return hasher.hexdigest()
+        with open(log_file) as log:
+            for line in log:
+                if line.startswith("File digest") and line.rstrip().endswith("verified"):
+                    return line.split()[2]
     except FileNotFoundError:
-        print(f"File not found: {file_path}")
-        return None
+        print(f"File not found: {log_file}")
+    return None
 
 
 def run(expname):
@@ -116,11 +113,12 @@ def run(expname):
                         )
                     with open(client_log_file, "w") as client_log:
                         h2.cmd(
-                            f"python3 -u p1_client.py {SERVER_IP} {SERVER_PORT} --pref_outfile {PREFIX_OUT+expname} > {client_log_file} 2>&1"
+                            f"python3 -u p1_client.py {SERVER_IP} {SERVER_PORT} --pref_outfile {PREFIX_OUT+expname} --verify > {client_log_file} 2>&1"
                         )
                     end_time = time.time()
                     ttc = end_time - start_time
-                    md5_hash = compute_md5("received_file.txt")
+                    # The client hashes the file as it writes it, no need to read it again
+                    md5_hash = read_verified_digest(client_log_file)
                     # write the result to a file
                     f_out.write(f"{LOSS},{DELAY},{FAST_RECOVERY},{md5_hash},{ttc}\n")
 
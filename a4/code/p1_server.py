@@ -1,49 +1,114 @@
+import os
 import socket
 import time
 import argparse
-from utils import make_packet, parse_packet
+import logging
+from utils import (
+    make_reply,
+    make_error,
+    MAX_HEADER_SIZE,
+    get_timestamp,
+    timestamp_diff,
+)
+from timers import RetransmissionTimer
+from batch_io import BatchIO
+from pmtu import MAX_PAYLOAD, PathMtuProber
+from compress import CompressedStream, choose_codec
+from integrity import choose_checksum, make_checksum, make_file_digest
+from rtt import RttEstimator
+from wire import WIRE_V1, is_get, parse_request_packet
+from catalog import Catalog, MappedFile
+from tracing import (
+    Tracer,
+    configure_logging,
+    LOG_LEVELS,
+    SEND,
+    RETRANSMIT,
+    TIMEOUT,
+    FAST_RETRANSMIT,
+    ACK,
+    EOF,
+)
 
 SERVER_FILE_PATH = "./test/test_100MB.bin"
 # SERVER_FILE_PATH = "./test/test.txt"
 
+log = logging.getLogger("p1_server")
+
 class Server:
-    # Maximum Segment Size for each packet
-    MSS = 50000000
-    # MSS = 1400
-    ALPHA = 0.125
-    BETA = 0.25
+    # Maximum Segment Size for each packet, fits a 1500 byte MTU with the header,
+    # the path MTU probe (--pmtu) can raise it
+    MSS = 1400
     # Threshold for duplicate ACKs to trigger fast recovery
     DUP_ACK_THRESHOLD = 3
     # Number of packets in flight
     WINDOW_SIZE = 1
     # Initial timeout value, # Initialize timeout to some value but update it as ACK packets arrive
     INITIAL_TIMEOUT = 1.0
+    # Bounds of the retransmission timeout, backoff stops at the upper one
+    MIN_TIMEOUT = 0.2
+    MAX_TIMEOUT = 60.0
     # Buffer size for receiving packets
     BUFFER_SIZE = 1000  # 64
     # Packets in flight
     RETRY_BEFORE_QUIT = 10
+    # Shortest wait for an ACK, settimeout(0) would make the socket non-blocking
+    MIN_TIMER_WAIT = 0.0001
+    # Datagrams moved per recvmmsg/sendmmsg call
+    BATCH_SIZE = 64
 
-    def __init__(self, server_ip, server_port, fast_recovery):
+    def __init__(self, server_ip, server_port, fast_recovery, sack, timestamps, root, trace_path):
         self.server_ip = server_ip
         self.server_port = server_port
         self.fast_recovery = fast_recovery
+        # Use the client's SACK ranges to retransmit only the real holes
+        self.sack = sack
+        # Stamp every data packet, the echoes give RTT samples even for retransmissions
+        self.timestamps = timestamps
+        # Files a client can ask for by name, SERVER_FILE_PATH when it names none
+        self.catalog = Catalog(root, SERVER_FILE_PATH)
+        # Per packet messages are only formatted when they are logged
+        self.debug = log.isEnabledFor(logging.DEBUG)
+        # Binary event trace of the transfer, None when not tracing
+        self.tracer = None if trace_path is None else Tracer(trace_path)
         # Server Socket Creation
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.server_socket.bind((self.server_ip, self.server_port))
-        print(f"Server listening on \t{self.server_ip}:{self.server_port}")
+        # sendmsg is not available on every platform (e.g. Windows)
+        self.use_sendmsg = hasattr(self.server_socket, "sendmsg")
+        self.batch_io = BatchIO(self.server_socket, self.BATCH_SIZE, self.BUFFER_SIZE)
+        log.info(f"Server listening on \t{self.server_ip}:{self.server_port}")
 
         # Start listening for clients
         self.client_count = 0
 
         # while True:
         self.reset_session()
-        self.listen_for_client()
+        try:
+            self.listen_for_client()
+        finally:
+            if self.tracer is not None:
+                self.tracer.close()
 
     def reset_session(self):
+        # Segment size until a client negotiates one
+        self.MSS = Server.MSS
+        # Codec the client negotiated, None sends the file as is
+        self.codec = None
+        # Segment checksum the client negotiated, None sends no checksums
+        self.checksum_name = None
+        self.checksum = None
+        # Send the digest of the whole file with the EOF
+        self.verify = False
+        # Packet format of the client, told by its GET
+        self.wire = WIRE_V1
         # RTT Variables
-        self.estimated_rtt = self.INITIAL_TIMEOUT
-        self.dev_rtt = 0.0
-        self.timeout_interval = self.estimated_rtt + 4 * self.dev_rtt
+        self.rtt_estimator = RttEstimator(
+            self.INITIAL_TIMEOUT, self.MIN_TIMEOUT, self.MAX_TIMEOUT
+        )
+        self.timeout_interval = self.rtt_estimator.rto
+        # Packets sent more than once, their ACKs are ambiguous without timestamps
+        self.retransmitted = set()
         # Client
         self.client_address = None
         self.LAF = -1
@@ -52,38 +117,123 @@ class Server:
         self.duplicate_acks = {}
         self.packet_in_flight = {}
         self.packet_timestamps = {}
+        # Sequence numbers above LAF that the client reported in SACK ranges
+        self.sacked = set()
+        self.highest_sacked = -1
+        # Retransmission deadlines of the packets in flight
+        self.retransmission_timer = RetransmissionTimer()
+        # Highest seq whose bookkeeping was already dropped
+        self.acked_upto = -1
 
     def listen_for_client(self):
         # Client Connection
         try:
             # Receive file request from client
             request, client_address = self.server_socket.recvfrom(self.BUFFER_SIZE)
-            print(f"Client connected on \t{client_address[0]}:{client_address[1]}")
-            decoded_request = request.decode()
-            if decoded_request == "GET":
+            log.info(f"Client connected on \t{client_address[0]}:{client_address[1]}")
+            command, options, self.wire = parse_request_packet(request)
+            if command == "GET":
                 self.client_address = client_address
-                print(f"Client Requested a file download")
+                log.info("Client Requested a file download")
+                self.file_path = self.catalog.resolve(options.get("file"))
+                if self.file_path is None:
+                    log.warning(f"Requested file {options['file']} is not served")
+                    self.server_socket.sendto(make_error("not_found"), client_address)
+                    return
+                # The client asks for the segment size to follow the path MTU
+                if "mtu" in options:
+                    self.MSS = self.negotiate_segment_size(
+                        min(int(options["mtu"]), MAX_PAYLOAD)
+                    )
+                # Codecs the client can decompress, in its order of preference
+                if "codecs" in options:
+                    self.codec = choose_codec(options["codecs"])
+                # Checksums the client can verify, in its order of preference
+                if "checksums" in options:
+                    self.checksum_name = choose_checksum(options["checksums"])
+                if self.checksum_name is not None:
+                    self.checksum = make_checksum(self.checksum_name)
+                self.verify = "verify" in options
+                # A GET with options expects the file metadata before any data
+                if options and not self.send_metadata():
+                    log.warning("Client did not confirm the file metadata")
+                    return
                 self.send_file()
-                print(f"Server closed...")
+                log.info("Server closed...")
             else:
-                print("Invalid request from client")
+                log.warning("Invalid request from client")
                 return
         except Exception as e:
-            print(f"Error: {e}")
+            log.error(f"Error: {e}")
             raise e
 
-    def get_file_read_offset(self):
-        if self.LFS == -1 or self.LAF == -1:
-            return 0
-        return self.LFS * self.MSS + 1
-
-    def read_data_from_file(self, file):
+    def negotiate_segment_size(self, client_limit):
+        # Largest datagram that reaches the client unfragmented, less the header
+        payload = PathMtuProber(
+            self.server_socket, self.client_address, client_limit
+        ).run()
+        log.info(f"Path MTU allows {payload} byte datagrams")
+        return payload - MAX_HEADER_SIZE
+
+    def send_metadata(self):
+        # Announce the file and segment size, the client confirms with ACK 0
+        metadata = {"size": os.path.getsize(self.file_path), "mss": self.MSS}
+        if self.codec is not None:
+            metadata["codec"] = self.codec
+        if self.checksum_name is not None:
+            metadata["checksum"] = self.checksum_name
+        reply = make_reply(metadata)
+        self.server_socket.settimeout(self.timeout_interval)
+        for _ in range(self.RETRY_BEFORE_QUIT):
+            self.server_socket.sendto(reply, self.client_address)
+            try:
+                packet, address = self.server_socket.recvfrom(self.BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            # A repeated GET means the reply was lost
+            if address == self.client_address and not is_get(packet):
+                return True
+        return False
+
+    def open_file(self, file_view):
+        # View of the whole mapped file, owned by the MappedFile of send_file
+        self.file_view = file_view
+        self.file_size = len(file_view)
+        # Updated with the file data in order as it is first sent
+        self.file_digest = make_file_digest() if self.verify else None
+        # Segments are cut from the compressed stream instead of the file
+        self.stream = None
+        if self.codec is not None:
+            self.stream = CompressedStream(
+                self.file_view, self.codec, self.MSS, self.file_digest
+            )
+
+    def close_file(self):
+        if self.stream is not None:
+            log.info(
+                f"Compressed {self.stream.offset} bytes into "
+                f"{self.stream.compressed_size} with {self.codec}"
+            )
+            self.stream = None
+        # Drop every reference into the mapping, the MappedFile releases it next
+        self.packet_in_flight.clear()
+        self.file_view = None
+
+    def has_segment(self, seq):
+        if self.stream is not None:
+            return self.stream.has_segment(seq)
+        return seq * self.MSS < self.file_size
+
+    def get_segment(self, seq):
+        if self.stream is not None:
+            return self.stream.get_segment(seq)
+        offset = seq * self.MSS
+        return self.file_view[offset : offset + self.MSS]
+
+    def read_data_from_file(self):
         # create a packets object of size WINDOW_SIZE
         self.all_packets_read = False
         packets = []
-        # Read the file from the current LFS * MSS position
-        file_read_offset = self.get_file_read_offset()
-        file.seek(file_read_offset)
 
         packet_range_min = 0
         packet_range_max = self.WINDOW_SIZE
@@ -96,13 +246,11 @@ class Server:
         i = packet_range_min
         while i < packet_range_max:
             seq_no = i
-            data = file.read(self.MSS)
-            if not data:
+            if not self.has_segment(seq_no):
                 self.all_packets_read = True
                 break
             else:
-                packets.append((seq_no, data))
-                self.packet_timestamps[seq_no] = time.time()
+                packets.append((seq_no, self.get_segment(seq_no)))
             i += 1
         return packets
 
@@ -110,129 +258,260 @@ class Server:
         start = self.LAF + 1
         end = self.LFS + 1
         retran_packets = []
-        for seq in range(start, end):
-            if time.time() - self.packet_timestamps[seq] >= self.timeout_interval:
-                _, data = parse_packet(self.packet_in_flight[seq])
-                retran_packets.append((seq, data))
+        for seq in self.retransmission_timer.pop_expired(time.time()):
+            # Timers of acked or sacked packets may still be armed
+            if seq < start or seq >= end or seq in self.sacked:
+                continue
+            if seq in self.packet_in_flight:
+                retran_packets.append((seq, self.packet_in_flight[seq]))
         return retran_packets
 
+    def make_data_header(self, seq, payload):
+        if self.timestamps:
+            return self.wire.make_data_header(seq, payload, get_timestamp(), self.checksum)
+        return self.wire.make_data_header(seq, payload, checksum=self.checksum)
+
+    def send_segment(self, seq, payload):
+        header = self.make_data_header(seq, payload)
+        if self.use_sendmsg:
+            # Scatter/gather send, the kernel reads the payload straight from the mapping
+            self.server_socket.sendmsg([header, payload], [], 0, self.client_address)
+        else:
+            self.server_socket.sendto(header + payload, self.client_address)
+
+    def mark_sent(self, seq):
+        now = time.time()
+        if seq in self.packet_timestamps:
+            self.retransmitted.add(seq)
+        self.packet_timestamps[seq] = now
+        self.retransmission_timer.arm(seq, now + self.timeout_interval)
+
+    def wait_for_next_deadline(self):
+        # Block for an ACK only until the earliest retransmission deadline
+        deadline = self.retransmission_timer.next_deadline()
+        if deadline is None:
+            self.server_socket.settimeout(self.timeout_interval)
+        else:
+            self.server_socket.settimeout(
+                max(deadline - time.time(), self.MIN_TIMER_WAIT)
+            )
 
     def send_packets_to_client(self, packets, retrans_packet=False):
-        for seq, packet_data in packets:
-            packet = make_packet(seq, packet_data)
-            self.server_socket.sendto(packet, self.client_address)
-            self.packet_timestamps[seq] = time.time()
-            self.packet_in_flight[seq] = packet
+        # The whole list goes out as one batch
+        self.batch_io.send_batch(
+            [
+                [self.make_data_header(seq, payload), payload]
+                for seq, payload in packets
+            ],
+            self.client_address,
+        )
+        for seq, payload in packets:
+            self.mark_sent(seq)
+            self.packet_in_flight[seq] = payload
             # Retransmission due to timeout
             if retrans_packet:
-                print(f"Packet {seq} retransmitted due to timeout.")
+                if self.debug:
+                    log.debug(f"Packet {seq} retransmitted due to timeout.")
+                if self.tracer is not None:
+                    self.trace(RETRANSMIT, seq)
             else:
                 # Normal Sending
                 self.LFS = seq
-                print(f"Sent seq {seq} ")
-
-    def update_time_interval(self, ack_num):
-        sample_rtt = time.time() - self.packet_timestamps[ack_num]
-        # Update EstimatedRTT and DevRTT
-        self.estimated_rtt = (
-            1 - self.ALPHA
-        ) * self.estimated_rtt + self.ALPHA * sample_rtt
-        self.dev_rtt = (1 - self.BETA) * self.dev_rtt + self.BETA * abs(
-            sample_rtt - self.estimated_rtt
+                if self.debug:
+                    log.debug(f"Sent seq {seq} ")
+                if self.tracer is not None:
+                    self.trace(SEND, seq)
+                # A compressed stream hashes the file as it compresses it
+                if self.file_digest is not None and self.stream is None:
+                    self.file_digest.update(payload)
+
+    def trace(self, event, seq):
+        self.tracer.record(
+            event, seq, self.WINDOW_SIZE * self.MSS, self.rtt_estimator.srtt, self.timeout_interval
         )
-        self.timeout_interval = self.estimated_rtt + 4 * self.dev_rtt
-        # print(f"Timeout interval : {self.timeout_interval}")
 
-    def handle_ack_recv(self, ack_num):
+    def get_rtt_sample(self, ack_num, echo, now):
+        # An echoed timestamp is unambiguous, otherwise only a packet sent once
+        # gives a sample (Karn's algorithm)
+        if echo is not None:
+            rtt = timestamp_diff(get_timestamp(now), echo[0])
+            return rtt if rtt >= 0 else None
+        seq = ack_num - 1
+        if seq > self.LAF and seq in self.packet_timestamps and seq not in self.retransmitted:
+            return now - self.packet_timestamps[seq]
+        return None
+
+    def update_time_interval(self, sample_rtt, now):
+        self.rtt_estimator.on_sample(sample_rtt, now)
+        self.timeout_interval = self.rtt_estimator.rto
+
+    def record_sack_blocks(self, sack_blocks):
+        for start, end in sack_blocks:
+            # Ignore anything already cumulatively acked or never sent
+            for seq in range(max(start, self.LAF + 1), min(end, self.LFS + 1)):
+                self.sacked.add(seq)
+                self.retransmission_timer.cancel(seq)
+                self.highest_sacked = max(self.highest_sacked, seq)
+
+    def get_sack_holes(self, ack_num):
+        # Holes are the unsacked seqs below the highest sacked seq, skipping the ones
+        # that were already (re)sent within the last RTT
+        holes = []
+        recent = self.rtt_estimator.srtt or self.timeout_interval
+        for seq in range(ack_num, self.highest_sacked):
+            if seq in self.sacked or seq not in self.packet_in_flight:
+                continue
+            if time.time() - self.packet_timestamps[seq] >= recent:
+                holes.append(seq)
+        return holes
+
+    def handle_ack_batch(self, acks):
+        # Only the newest cumulative ACK of the batch matters, its copies count as
+        # duplicates and the SACK ranges of every ACK are merged
+        parsed_acks = [self.wire.parse_ack(ack) for ack in acks]
+        parsed_acks = [parsed for parsed in parsed_acks if parsed is not None]
+        if not parsed_acks:
+            return
+        ack_num = max(ack_num for ack_num, _, _ in parsed_acks)
+        repeats = sum(1 for num, _, _ in parsed_acks if num == ack_num)
+        sack_blocks = [block for _, blocks, _ in parsed_acks for block in blocks]
+        echoes = [echo for _, _, echo in parsed_acks if echo is not None]
+        self.handle_ack_recv(ack_num, sack_blocks, repeats, echoes[-1] if echoes else None)
+
+    def handle_ack_recv(self, ack_num, sack_blocks=(), repeats=1, echo=None):
         if ack_num > self.LFS + self.WINDOW_SIZE:
             return
+        if self.sack:
+            self.record_sack_blocks(sack_blocks)
         if ack_num <= self.LAF:
             return
+        # Calculate Sample RTT
+        now = time.time()
+        rtt = self.get_rtt_sample(ack_num, echo, now)
+        if rtt is not None:
+            self.update_time_interval(rtt, now)
+
         # Update ack condition
         self.LAF = ack_num - 1
-        print(f"Cumulative ACK received: {ack_num}")
-
-        # Calculate Sample RTT
-        if self.LAF in self.packet_timestamps:
-            self.update_time_interval(self.LAF)
+        if self.debug:
+            log.debug(f"Cumulative ACK received: {ack_num}")
+        if self.tracer is not None:
+            self.trace(ACK, ack_num)
 
         if ack_num in self.duplicate_acks:
-            self.duplicate_acks[ack_num] += 1
+            self.duplicate_acks[ack_num] += repeats
         else:
-            self.duplicate_acks[ack_num] = 1
+            self.duplicate_acks[ack_num] = repeats
 
         duplicate_ack_count = self.duplicate_acks[ack_num]
 
         if self.fast_recovery:
+            if self.sack and self.sacked and duplicate_ack_count >= self.DUP_ACK_THRESHOLD:
+                # Retransmit every hole the SACK ranges point at, not only ack_num
+                for seq in self.get_sack_holes(ack_num):
+                    if self.debug:
+                        log.debug(f"SACK recovery: Retransmitting seq {seq}")
+                    if self.tracer is not None:
+                        self.trace(FAST_RETRANSMIT, seq)
+                    self.send_segment(seq, self.packet_in_flight[seq])
+                    self.mark_sent(seq)
+                return
             if duplicate_ack_count >= self.DUP_ACK_THRESHOLD and ack_num != self.LAF:
-                print(f"Fast recovery: Retransmitting seq {ack_num}")
+                if self.debug:
+                    log.debug(f"Fast recovery: Retransmitting seq {ack_num}")
+                if self.tracer is not None:
+                    self.trace(FAST_RETRANSMIT, ack_num)
                 # Find the packet and retransmit
                 seq = ack_num
-                _, data = parse_packet(self.packet_in_flight[seq])
-                packet = make_packet(seq, data)
-                self.server_socket.sendto(packet, self.client_address)
-                self.packet_timestamps[seq] = time.time()
+                self.send_segment(seq, self.packet_in_flight[seq])
+                self.mark_sent(seq)
                 # self.duplicate_acks[ack_num] = 0
                 return
         # print("Duplicate Acks", self.duplicate_acks)
-        # Delete all the keys equal to and below ack_num
-        for key in list(self.packet_timestamps.keys()):
-            if key <= self.LAF:
-                del self.packet_timestamps[key]
-                del self.packet_in_flight[key]
+        # Delete all the keys equal to and below ack_num, the ones up to acked_upto are already gone
+        for key in range(self.acked_upto + 1, self.LAF + 1):
+            self.packet_timestamps.pop(key, None)
+            self.retransmitted.discard(key)
+            self.packet_in_flight.pop(key, None)
+            self.sacked.discard(key)
+            self.retransmission_timer.cancel(key)
+        self.acked_upto = max(self.acked_upto, self.LAF)
 
     def send_eof(self):
-        eof_packet = make_packet(self.LFS + 1, b"EOF")
+        digest = None if self.file_digest is None else self.file_digest.hexdigest()
+        eof_packet = self.wire.make_eof(self.LFS + 1, digest, checksum=self.checksum)
         self.server_socket.sendto(eof_packet, self.client_address)
 
     def send_file(self):
         """
         Send a predefined file to the client, ensuring reliability over UDP.
         """
-        print("Sending file to client")
+        log.info("Sending file to client")
         # Assume the sequence number starts from 1
-        with open(SERVER_FILE_PATH, "rb") as f:
-            while True:
-                print(f"LAF: {self.LAF}, LFS: {self.LFS}")
-
-                # 1 - Determine the packets to be sent
-                packets_to_send = self.read_data_from_file(f)
-                # 2 - Send the Packets
-                self.send_packets_to_client(packets_to_send)
-
-                # 3 - Wait for the Acknowledgement
-                try:
-                    ack, _ = self.server_socket.recvfrom(self.BUFFER_SIZE)
-                    ack_num = int.from_bytes(ack, "big")
-                    self.handle_ack_recv(ack_num)
-                except socket.timeout:
-                    print("Timeout occurred while waiting for ACK.")
-                    continue
-
-                packets_to_retransmit = self.get_retransmission_packets()
-                self.send_packets_to_client(packets_to_retransmit, retrans_packet=True)
-
-                # 4 - Check if the file is sent
-                if self.all_packets_read and self.LAF == self.LFS:
-                    eof_counter = 0
-                    while eof_counter < self.RETRY_BEFORE_QUIT:
-                        self.send_eof()
-                        eof_counter = eof_counter + 1
-                        print(f"Trying for {eof_counter} time. EOF Sent")
-                        try:
-                            ack, _ = self.server_socket.recvfrom(self.BUFFER_SIZE)
-                            ack_num = int.from_bytes(ack, "big")
-                            if ack_num == self.LAF + 2:
-                                print("Final ack", ack_num)
-                                break
-                                
-
-                        except socket.timeout:
-                            print("Timeout occurred while waiting for EOF ACK.")
-                            continue
-                    self.client_count += 1
-                    print(f"File sent successfully {self.client_count} times.")
-                    return
+        with MappedFile(self.file_path) as mapped:
+            self.open_file(mapped.view)
+            try:
+                self.send_segments()
+            finally:
+                self.close_file()
+
+    def send_segments(self):
+        # Segments held by the locals here are dropped when it returns
+        while True:
+            if self.debug:
+                log.debug(f"LAF: {self.LAF}, LFS: {self.LFS}")
+
+            # 1 - Determine the packets to be sent
+            packets_to_send = self.read_data_from_file()
+            # 2 - Send the Packets
+            self.send_packets_to_client(packets_to_send)
+
+            # 3 - Wait for the Acknowledgement
+            self.wait_for_next_deadline()
+            try:
+                ack, _ = self.server_socket.recvfrom(self.BUFFER_SIZE)
+                # Drain every other ACK that is already queued
+                acks = [ack] + [data for data, _ in self.batch_io.recv_batch()]
+                self.handle_ack_batch(acks)
+            except socket.timeout:
+                # A retransmission deadline passed, the expired packets are resent below
+                if self.debug:
+                    log.debug("Timeout occurred while waiting for ACK.")
+                if self.tracer is not None:
+                    self.trace(TIMEOUT, self.LAF + 1)
+
+            packets_to_retransmit = self.get_retransmission_packets()
+            if packets_to_retransmit:
+                # Back off until the next RTT sample
+                self.rtt_estimator.on_timeout()
+                self.timeout_interval = self.rtt_estimator.rto
+            self.send_packets_to_client(packets_to_retransmit, retrans_packet=True)
+
+            # 4 - Check if the file is sent
+            if self.all_packets_read and self.LAF == self.LFS:
+                eof_counter = 0
+                self.server_socket.settimeout(self.timeout_interval)
+                while eof_counter < self.RETRY_BEFORE_QUIT:
+                    self.send_eof()
+                    eof_counter = eof_counter + 1
+                    log.info(f"Trying for {eof_counter} time. EOF Sent")
+                    if self.tracer is not None:
+                        self.trace(EOF, self.LFS + 1)
+                    try:
+                        ack, _ = self.server_socket.recvfrom(self.BUFFER_SIZE)
+                        parsed = self.wire.parse_ack(ack)
+                        ack_num = None if parsed is None else parsed[0]
+                        if ack_num == self.LAF + 2:
+                            log.info(f"Final ack {ack_num}")
+                            break
+                            
+
+                    except socket.timeout:
+                        log.info("Timeout occurred while waiting for EOF ACK.")
+                        continue
+                self.client_count += 1
+                log.info(f"File sent successfully {self.client_count} times.")
+                return
 
 
 # Parse command-line arguments
@@ -243,7 +522,26 @@ def read_args():
     parser.add_argument("server_ip", help="IP address of the server")
     parser.add_argument("server_port", type=int, help="Port number of the server")
     parser.add_argument("fast_recovery", help="Enable fast recovery")
+    parser.add_argument(
+        "--sack", action="store_true", help="Retransmit only the holes reported by SACK"
+    )
+    parser.add_argument(
+        "--timestamps",
+        action="store_true",
+        help="Timestamp data packets for unambiguous RTT samples",
+    )
+    parser.add_argument(
+        "--root", help="Directory of the files clients may ask for by name"
+    )
+    parser.add_argument(
+        "--log_level",
+        choices=sorted(LOG_LEVELS),
+        default="info",
+        help="debug logs every packet, which slows the transfer down",
+    )
+    parser.add_argument("--trace", help="Record binary transfer events to this file")
     args = parser.parse_args()
+    configure_logging(args.log_level)
     fast_recovery = args.fast_recovery
     if (
         fast_recovery == "0"
@@ -251,10 +549,10 @@ def read_args():
         or fast_recovery == False
         or fast_recovery == 0
     ):
-        return (args.server_ip, args.server_port, False)
+        return (args.server_ip, args.server_port, False, args.sack, args.timestamps, args.root, args.trace)
 
     else:
-        return (args.server_ip, args.server_port, True)
+        return (args.server_ip, args.server_port, True, args.sack, args.timestamps, args.root, args.trace)
 
 
 if __name__ == "__main__":
@@ -7,7 +7,6 @@ from mininet.cli import CLI
 from mininet.log import setLogLevel
 import time, re, os
 import sys
-import hashlib
 import subprocess 
 
 class DumbbellTopo(Topo):    
@@ -44,21 +43,18 @@ def jain_fairness_index(allocations):
     jfi = (sum_of_allocations ** 2) / (n * sum_of_squares)
     return jfi
 
-def compute_md5(file_path):
-    """Compute the MD5 hash of a file."""
-    hasher = hashlib.md5()
+def read_verified_digest(log_file):
+    """Return the file MD5 the client verified against the server's, None if it did not."""
     try:
-
-        with open(file_path, 'rb') as file:
-            # Read the file in chunks to avoid using too much memory for large files
-            while chunk := file.read(8192):
-                hasher.update(chunk)
-        return hasher.hexdigest()
+        with open(log_file) as log:
+            for line in log:
+                if line.startswith("File digest") and line.rstrip().endswith("verified"):
+                    return line.split()[2]
     except FileNotFoundError:
-        print(f"File not found: {file_path}")
-        return None
+        print(f"File not found: {log_file}")
+    return None
 
-def run(enable_log):
+def run(enable_log, cc):
     # Set the log level to info to see detailed output
     setLogLevel('info')
     
@@ -67,7 +63,7 @@ def run(enable_log):
     controller_port = 6653       # Default OpenFlow controller port
     
     # Output file 
-    output_file = f'p2_fairness.csv'
+    output_file = f'p2_fairness_{cc}.csv'
     f_out = open(output_file, 'w')
     f_out.write("delay,md5_hash_1,md5_hash_2,ttc1,ttc2,jfi\n")
 
@@ -108,10 +104,11 @@ def run(enable_log):
             
             pref_c1 = "1"
             pref_c2 = "2"
-            s1_cmd = f"python3 -u p2_server.py {SERVER_IP1} {SERVER_PORT1} &"
-            s2_cmd = f"python3 -u p2_server.py {SERVER_IP2} {SERVER_PORT2} &"
-            c1_cmd = f"python3 -u p2_client.py {SERVER_IP1} {SERVER_PORT1} --pref_outfile {pref_c1} &"
-            c2_cmd = f"python3 -u p2_client.py {SERVER_IP2} {SERVER_PORT2} --pref_outfile {pref_c2} &"
+            s1_cmd = f"python3 -u p2_server.py {SERVER_IP1} {SERVER_PORT1} --cc {cc} &"
+            s2_cmd = f"python3 -u p2_server.py {SERVER_IP2} {SERVER_PORT2} --cc {cc} &"
+            # Without logs only the client's digest line is kept
+            c1_cmd = f"python3 -u p2_client.py {SERVER_IP1} {SERVER_PORT1} --pref_outfile {pref_c1} --verify | grep 'File digest' > {pref_c1}_digest.log &"
+            c2_cmd = f"python3 -u p2_client.py {SERVER_IP2} {SERVER_PORT2} --pref_outfile {pref_c2} --verify | grep 'File digest' > {pref_c2}_digest.log &"
 
             if enable_log:
                 log_folder = "p2_logs"
@@ -134,9 +131,9 @@ def run(enable_log):
                     f"client2_{DELAY}_{i}.log"
                 )
                 with open(server1_log_file, "w") as server1_log:
-                    s1.cmd(f"python3 -u p2_server.py {SERVER_IP1} {SERVER_PORT1} > {server1_log_file} 2>&1 &")
+                    s1.cmd(f"python3 -u p2_server.py {SERVER_IP1} {SERVER_PORT1} --cc {cc} > {server1_log_file} 2>&1 &")
                 with open(server2_log_file, "w") as server2_log:
-                    s2.cmd(f"python3 -u p2_server.py {SERVER_IP2} {SERVER_PORT2} > {server2_log_file} 2>&1 &")
+                    s2.cmd(f"python3 -u p2_server.py {SERVER_IP2} {SERVER_PORT2} --cc {cc} > {server2_log_file} 2>&1 &")
             else:
                 s1.cmd(s1_cmd)
                 s2.cmd(s2_cmd)
@@ -149,7 +146,7 @@ def run(enable_log):
             if enable_log:
                 with open(client1_log_file, "w") as client1_log:
                     while True:
-                        c1_pid_raw = c1.cmd(f"python3 -u p2_client.py {SERVER_IP1} {SERVER_PORT1} --pref_outfile {pref_c1} > {client1_log_file} 2>&1 &").strip()
+                        c1_pid_raw = c1.cmd(f"python3 -u p2_client.py {SERVER_IP1} {SERVER_PORT1} --pref_outfile {pref_c1} --verify > {client1_log_file} 2>&1 &").strip()
                         # c1_pid_raw = c1.cmd(c1_cmd).strip()
                         if len(c1_pid_raw.split()) == 0:
                             continue
@@ -173,7 +170,7 @@ def run(enable_log):
             if enable_log:
                 with open(client2_log_file, "w") as client2_log:
                     while True:
-                        c2_pid_raw = c2.cmd(f"python3 -u p2_client.py {SERVER_IP2} {SERVER_PORT2} --pref_outfile {pref_c2} > {client2_log_file} 2>&1 &").strip()
+                        c2_pid_raw = c2.cmd(f"python3 -u p2_client.py {SERVER_IP2} {SERVER_PORT2} --pref_outfile {pref_c2} --verify > {client2_log_file} 2>&1 &").strip()
                         # c2_pid_raw = c2.cmd(c2_cmd).strip()
                         if len(c2_pid_raw.split()) == 0:
                             continue
@@ -218,9 +215,9 @@ def run(enable_log):
             jfi = jain_fairness_index([1/dur_c1, 1/dur_c2])
             
             print(dur_c1, dur_c2, jfi) 
-            # calculate md5 hash
-            hash1 = compute_md5(f"{pref_c1}_{OUTFILE}")
-            hash2 = compute_md5(f"{pref_c2}_{OUTFILE}")
+            # md5 hash the clients verified while writing
+            hash1 = read_verified_digest(client1_log_file if enable_log else f"{pref_c1}_digest.log")
+            hash2 = read_verified_digest(client2_log_file if enable_log else f"{pref_c2}_digest.log")
 
 
             f_out.write(f"{DELAY},{hash1},{hash2},{dur_c1},{dur_c2},{jfi}\n")
@@ -235,9 +232,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the experiment for fairness")
     # add a flag to enable logging
     parser.add_argument("--log", type=int, default=0, help="Enable logging")
+    parser.add_argument("--cc", default="reno", help="Congestion control algorithm of the servers")
     args = parser.parse_args()
     
     if args.log == 0:
-        run(enable_log=False)
+        run(enable_log=False, cc=args.cc)
     else:
-        run(enable_log=True)
+        run(enable_log=True, cc=args.cc)
@@ -0,0 +1,46 @@
+import math
+
+
+class Pacer:
+    """
+    Token bucket spreading transmissions at `rate` bytes per second. Tokens build
+    up to `burst` bytes while the sender is idle, so at most that much goes out
+    back to back and everything beyond waits for the bucket to refill. Without a
+    rate nothing is held back.
+    """
+
+    def __init__(self, burst):
+        self.burst = burst
+        self.rate = None
+        self.tokens = burst
+        self.last_refill = None
+
+    def set_rate(self, rate, now):
+        # Tokens earned so far are credited at the old rate
+        self.refill(now)
+        self.rate = rate
+
+    def refill(self, now):
+        if self.rate and self.last_refill is not None:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.last_refill) * self.rate
+            )
+        self.last_refill = now
+
+    def get_allowance(self, now):
+        # Bytes that may be sent right now
+        if not self.rate:
+            return math.inf
+        self.refill(now)
+        return max(self.tokens, 0)
+
+    def consume(self, size):
+        # Retransmissions may overdraw the bucket, new data then waits longer
+        if self.rate:
+            self.tokens -= size
+
+    def get_next_send_time(self, size):
+        # When `size` bytes will be allowed, assuming the rate does not change
+        if not self.rate or self.tokens >= size:
+            return self.last_refill or 0
+        return self.last_refill + (size - self.tokens) / self.rate
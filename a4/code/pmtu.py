@@ -0,0 +1,138 @@
+import errno
+import socket
+import sys
+import time
+from utils import make_request, parse_request
+
+# IPv4 and UDP headers in front of every payload
+IP_UDP_OVERHEAD = 28
+# Every IPv4 host accepts 576 byte datagrams, the search never goes below
+MIN_MTU = 576
+# Assumed when the kernel cannot tell the route MTU
+DEFAULT_MTU = 1500
+# Largest UDP payload over IPv4
+MAX_PAYLOAD = 65507
+
+# Linux socket options, the socket module does not export them
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_DO = 2
+IP_MTU = 14
+
+
+def make_probe(size, padded=True):
+    # A probe is padded to `size` bytes of UDP payload, its echo is not
+    probe = make_request("PROBE", {"size": size})
+    return probe.ljust(size) if padded else probe
+
+
+def parse_probe(packet):
+    # Size of a probe or of its echo, None for any other packet
+    if not packet.startswith(b"PROBE "):
+        return None
+    _, options = parse_request(bytes(packet[:64]))
+    try:
+        return int(options["size"])
+    except (KeyError, ValueError):
+        return None
+
+
+class PathMtuProber:
+    """
+    Binary search for the largest UDP payload that reaches `peer_address`
+    unfragmented. Probes leave from the data socket, so they take the same path
+    through NATs and firewalls, with the don't fragment bit set only while the
+    search runs. A size is good once the peer echoes it, and bad when the kernel
+    refuses to send it (EMSGSIZE, the route MTU is known to be smaller) or no
+    echo arrives in time. Without IP_MTU_DISCOVER (not Linux) probes could be
+    fragmented on the way, the search then stays below DEFAULT_MTU.
+    """
+
+    PROBE_TIMEOUT = 0.2
+    PROBE_TRIES = 2
+    # The search stops once the bounds are this close (in bytes)
+    PRECISION = 8
+
+    def __init__(self, sock, peer_address, limit):
+        self.sock = sock
+        self.peer_address = peer_address
+        self.limit = limit
+        self.low = MIN_MTU - IP_UDP_OVERHEAD
+        self.high = self.low
+        # IP_MTU_DISCOVER mode of the socket before the search, None when not settable
+        self.saved_mode = None
+
+    def set_dont_fragment(self):
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            self.saved_mode = self.sock.getsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER)
+            self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        except OSError:
+            self.saved_mode = None
+            return False
+        return True
+
+    def restore_fragmentation(self):
+        if self.saved_mode is not None:
+            self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, self.saved_mode)
+
+    def get_route_payload(self):
+        # Largest payload the kernel would currently send to the peer, IP_MTU is
+        # only readable on a connected socket
+        if self.saved_mode is None:
+            return DEFAULT_MTU - IP_UDP_OVERHEAD
+        route_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            route_socket.connect(self.peer_address)
+            mtu = route_socket.getsockopt(socket.IPPROTO_IP, IP_MTU)
+        except OSError:
+            mtu = DEFAULT_MTU
+        finally:
+            route_socket.close()
+        return min(mtu - IP_UDP_OVERHEAD, MAX_PAYLOAD)
+
+    def probe(self, size):
+        for _ in range(self.PROBE_TRIES):
+            try:
+                self.sock.sendto(make_probe(size), self.peer_address)
+            except OSError as e:
+                if e.errno != errno.EMSGSIZE:
+                    raise
+                # An ICMP fragmentation needed may have lowered the route MTU
+                self.high = min(self.high, self.get_route_payload())
+                return False
+            deadline = time.time() + self.PROBE_TIMEOUT
+            while True:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    break
+                self.sock.settimeout(wait)
+                try:
+                    echo, address = self.sock.recvfrom(128)
+                except socket.timeout:
+                    break
+                # Echoes of earlier probes and repeated requests are ignored
+                if address == self.peer_address and parse_probe(echo) == size:
+                    return True
+        return False
+
+    def run(self):
+        """
+        Returns the largest good payload size, at least MIN_MTU - IP_UDP_OVERHEAD.
+        """
+        self.set_dont_fragment()
+        try:
+            self.high = max(min(self.limit, self.get_route_payload()), self.low)
+            # The route MTU is usually right, one round trip confirms it
+            if self.probe(self.high):
+                return self.high
+            self.high -= 1
+            while self.high - self.low > self.PRECISION:
+                size = (self.low + self.high + 1) // 2
+                if self.probe(size):
+                    self.low = size
+                else:
+                    self.high = min(self.high, size - 1)
+            return self.low
+        finally:
+            self.restore_fragmentation()
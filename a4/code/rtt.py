@@ -0,0 +1,51 @@
+class RttEstimator:
+    """
+    Retransmission timeout of RFC 6298: smoothed RTT and RTT variance from the
+    samples, RTO = SRTT + max(G, 4 * RTTVAR) within [min_rto, max_rto], doubled
+    on every timeout until the next sample. Samples must be unambiguous, either
+    echoed timestamps or packets that were sent only once (Karn's algorithm).
+    Also tracks the lowest RTT seen within the last MIN_RTT_WINDOW seconds, the
+    congestion controllers read it as the propagation delay of the path.
+    """
+
+    ALPHA = 0.125
+    BETA = 0.25
+    K = 4
+    # Clock granularity G
+    CLOCK_GRANULARITY = 0.001
+    # Seconds a min RTT sample is remembered
+    MIN_RTT_WINDOW = 10.0
+
+    def __init__(self, initial_rto=1.0, min_rto=0.2, max_rto=60.0):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rtt = None
+        self.min_rtt_stamp = None
+        # The last sample replaced a min RTT older than MIN_RTT_WINDOW
+        self.min_rtt_expired = False
+
+    def on_sample(self, rtt, now):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        # A fresh sample also ends any backoff
+        self.rto = min(
+            max(self.srtt + max(self.CLOCK_GRANULARITY, self.K * self.rttvar), self.min_rto),
+            self.max_rto,
+        )
+        self.min_rtt_expired = (
+            self.min_rtt_stamp is not None and now - self.min_rtt_stamp > self.MIN_RTT_WINDOW
+        )
+        if self.min_rtt is None or rtt <= self.min_rtt or self.min_rtt_expired:
+            self.min_rtt = rtt
+            self.min_rtt_stamp = now
+
+    def on_timeout(self):
+        # Exponential backoff
+        self.rto = min(self.rto * 2, self.max_rto)
@@ -0,0 +1,63 @@
+import heapq
+
+
+class RetransmissionTimer:
+    """
+    Retransmission deadlines for the packets in flight, kept in a min-heap so the
+    sender can find the next expiry without walking the whole window.
+    """
+
+    # Rebuild the heap once stale entries outnumber live ones by this factor
+    COMPACT_FACTOR = 2
+
+    def __init__(self):
+        # (deadline, seq) entries, re-armed or cancelled seqs leave stale entries
+        # behind which are dropped lazily when they reach the top of the heap
+        self.heap = []
+        # Live deadline of every armed seq
+        self.deadlines = {}
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def arm(self, seq, deadline):
+        self.deadlines[seq] = deadline
+        heapq.heappush(self.heap, (deadline, seq))
+        if len(self.heap) > self.COMPACT_FACTOR * len(self.deadlines) + 64:
+            self.compact()
+
+    def cancel(self, seq):
+        self.deadlines.pop(seq, None)
+
+    def compact(self):
+        self.heap = [(deadline, seq) for seq, deadline in self.deadlines.items()]
+        heapq.heapify(self.heap)
+
+    def drop_stale(self):
+        while self.heap:
+            deadline, seq = self.heap[0]
+            if self.deadlines.get(seq) == deadline:
+                return
+            heapq.heappop(self.heap)
+
+    def next_deadline(self):
+        """
+        Earliest live deadline, or None when nothing is armed.
+        """
+        self.drop_stale()
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def pop_expired(self, now):
+        """
+        Disarm and return every seq whose deadline is at or before `now`.
+        """
+        expired = []
+        self.drop_stale()
+        while self.heap and self.heap[0][0] <= now:
+            _, seq = heapq.heappop(self.heap)
+            del self.deadlines[seq]
+            expired.append(seq)
+            self.drop_stale()
+        return expired
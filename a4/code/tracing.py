@@ -0,0 +1,159 @@
+import argparse
+import csv
+import logging
+import struct
+import sys
+import time
+
+# NumPy is optional, only the decoder's --npy output needs it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Event types
+SEND = 1
+RETRANSMIT = 2
+TIMEOUT = 3
+FAST_RETRANSMIT = 4
+ACK = 5
+RECV = 6
+DUPLICATE = 7
+CORRUPT = 8
+ACK_SENT = 9
+EOF = 10
+EVENT_NAMES = {
+    SEND: "send",
+    RETRANSMIT: "retransmit",
+    TIMEOUT: "timeout",
+    FAST_RETRANSMIT: "fast_retransmit",
+    ACK: "ack",
+    RECV: "recv",
+    DUPLICATE: "duplicate",
+    CORRUPT: "corrupt",
+    ACK_SENT: "ack_sent",
+    EOF: "eof",
+}
+
+# timestamp (s), seq, cwnd (bytes), srtt (s), rto (s), event type, 32 bytes
+RECORD = struct.Struct("<dqfffH2x")
+FIELDS = ("timestamp", "seq", "cwnd", "srtt", "rto", "event")
+# Start of every trace file, followed by the records
+FILE_MAGIC = b"A4TRACE\x01"
+
+LOG_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+}
+
+
+def configure_logging(level):
+    # Plain messages on stdout, the experiment scripts read the client's output
+    logging.basicConfig(stream=sys.stdout, format="%(message)s", level=LOG_LEVELS[level])
+
+
+class Tracer:
+    """
+    Records fixed-size binary events into a buffer of `capacity` records that is
+    allocated once. When it is full the whole buffer goes to the file in one
+    write and filling starts over at its beginning, so the hot path only packs
+    32 bytes in place.
+    """
+
+    CAPACITY = 1 << 15
+
+    def __init__(self, path, capacity=CAPACITY):
+        self.file = open(path, "wb")
+        self.file.write(FILE_MAGIC)
+        self.buffer = bytearray(RECORD.size * capacity)
+        self.view = memoryview(self.buffer)
+        self.offset = 0
+        # Looked up once, record() is called for every packet
+        self.end = len(self.buffer)
+        self.pack_into = RECORD.pack_into
+
+    def record(self, event, seq, cwnd=0, srtt=None, rto=0):
+        offset = self.offset
+        self.pack_into(self.buffer, offset, time.time(), seq, cwnd, srtt or 0, rto, event)
+        offset += RECORD.size
+        self.offset = offset
+        if offset == self.end:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.view[: self.offset])
+        self.offset = 0
+
+    def close(self):
+        self.flush()
+        self.view.release()
+        self.file.close()
+
+
+def read_trace(path):
+    # Every record of a trace file as a tuple in the order of FIELDS
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(FILE_MAGIC):
+        raise ValueError(f"{path} is not a trace file")
+    # A trace cut short by a crash ends with a partial record
+    end = len(data) - (len(data) - len(FILE_MAGIC)) % RECORD.size
+    return list(RECORD.iter_unpack(memoryview(data)[len(FILE_MAGIC) : end]))
+
+
+def load_numpy(path):
+    # The records as a NumPy structured array with the FIELDS as columns
+    dtype = numpy.dtype(
+        {
+            "names": list(FIELDS),
+            "formats": ["<f8", "<i8", "<f4", "<f4", "<f4", "<u2"],
+            "offsets": [0, 8, 16, 20, 24, 28],
+            "itemsize": RECORD.size,
+        }
+    )
+    with open(path, "rb") as f:
+        if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        return numpy.fromfile(f, dtype=dtype)
+
+
+def write_csv(records, out):
+    writer = csv.writer(out)
+    writer.writerow(FIELDS)
+    for timestamp, seq, cwnd, srtt, rto, event in records:
+        writer.writerow(
+            [
+                f"{timestamp:.6f}",
+                seq,
+                f"{cwnd:.0f}",
+                f"{srtt:.6f}",
+                f"{rto:.6f}",
+                EVENT_NAMES.get(event, event),
+            ]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Decode a binary event trace of a client or server (--trace)."
+    )
+    parser.add_argument("trace", help="Trace file")
+    parser.add_argument("--csv", help="Write CSV to this file instead of stdout")
+    parser.add_argument("--npy", help="Save the records as a NumPy array (.npy)")
+    args = parser.parse_args()
+    if args.npy is not None:
+        if numpy is None:
+            sys.exit("--npy needs NumPy")
+        numpy.save(args.npy, load_numpy(args.trace))
+        return
+    records = read_trace(args.trace)
+    if args.csv is None:
+        write_csv(records, sys.stdout)
+    else:
+        with open(args.csv, "w", newline="") as out:
+            write_csv(records, out)
+
+
+if __name__ == "__main__":
+    main()
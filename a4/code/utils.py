@@ -1,23 +1,204 @@
 import json
 import pickle
+import time
 
-def make_packet(seq, data):
+# Set in the seq length byte of a data packet that carries a send timestamp
+TIMESTAMP_FLAG = 0x80
+# Set in the seq length byte of a parity packet, its seq is the first seq of the block
+PARITY_FLAG = 0x40
+# Set in the seq length byte of a data packet whose header ends with a 4-byte checksum
+CHECKSUM_FLAG = 0x20
+# Bits of the seq length byte that hold the length
+SEQ_LENGTH_MASK = 0x1F
+# Set in the cumulative ACK when it echoes a timestamp
+ACK_TIMESTAMP_FLAG = 1 << 31
+# Room for the largest data or parity header of either wire format
+MAX_HEADER_SIZE = 32
+
+def get_timestamp(now=None):
+    # Microseconds on the local clock, wrapping at 32 bits
+    if now is None:
+        now = time.time()
+    return int(now * 1000000) & 0xFFFFFFFF
+
+def timestamp_diff(later, earlier):
+    # Seconds between two timestamps of get_timestamp(), negative when `later` is earlier
+    diff = (later - earlier) & 0xFFFFFFFF
+    if diff >= 1 << 31:
+        diff -= 1 << 32
+    return diff / 1000000
+
+def make_header(seq, timestamp=None):
     # Convert `seq` to a bytes object of minimum length needed to represent the integer
     seq_bytes = seq.to_bytes((seq.bit_length() + 7) // 8, byteorder='big', signed=False)
-    
-    # Store the length of seq_bytes in one byte, followed by the seq and data
-    packet = len(seq_bytes).to_bytes(1, byteorder='big') + seq_bytes + data
+
+    # Store the length of seq_bytes in one byte, followed by the seq
+    if timestamp is None:
+        return len(seq_bytes).to_bytes(1, byteorder='big') + seq_bytes
+    # The flagged length is followed by the seq and a 4-byte send timestamp
+    return (
+        (len(seq_bytes) | TIMESTAMP_FLAG).to_bytes(1, byteorder='big')
+        + seq_bytes
+        + timestamp.to_bytes(4, byteorder='big')
+    )
+
+def make_packet(seq, data, timestamp=None):
+    # The header is followed directly by the data
+    packet = make_header(seq, timestamp) + data
     return packet
 
 def parse_packet(packet):
+    seq, data, _ = parse_timestamped_packet(packet)
+    return seq, data
+
+def parse_timestamped_packet(packet):
     # Read the first byte to know the length of `seq`
     seq_len = int.from_bytes(packet[0:1], byteorder='big')
+    timestamp = None
     
     # Extract `seq` using the length we just read
-    seq_bytes = packet[1:1 + seq_len]
+    seq_bytes = packet[1:1 + (seq_len & SEQ_LENGTH_MASK)]
     seq = int.from_bytes(seq_bytes, byteorder='big', signed=False)
     
     # The remaining part of `packet` is `data`
-    data = packet[1 + seq_len:]
+    data = packet[1 + len(seq_bytes):]
+    if seq_len & TIMESTAMP_FLAG:
+        timestamp = int.from_bytes(data[0:4], byteorder='big')
+        data = data[4:]
+    if seq_len & CHECKSUM_FLAG:
+        data = data[4:]
     
-    return seq, data
\ No newline at end of file
+    return seq, data, timestamp
+
+def add_checksum(header, payload, checksum):
+    # Flag the header and append the checksum of the flagged header and the payload
+    header = bytes([header[0] | CHECKSUM_FLAG]) + header[1:]
+    value = checksum(payload, checksum(header))
+    return header + value.to_bytes(4, byteorder='big')
+
+def verify_checksum(packet, checksum):
+    # With a checksum negotiated every packet must carry one that matches
+    flags = packet[0]
+    if checksum is None:
+        return True
+    if not flags & CHECKSUM_FLAG:
+        return False
+    offset = 1 + (flags & SEQ_LENGTH_MASK) + (4 if flags & TIMESTAMP_FLAG else 0)
+    if flags & PARITY_FLAG:
+        # k, r and the parity index are checked as part of the header
+        offset += 3
+    value = checksum(packet[offset + 4:], checksum(packet[:offset]))
+    return value == int.from_bytes(packet[offset:offset + 4], byteorder='big')
+
+def make_eof(digest=None):
+    # EOF payload, followed by the hex MD5 of the whole file when the client verifies it
+    if digest is None:
+        return b"EOF"
+    return f"EOF md5={digest}".encode()
+
+def is_eof(data, digest=False):
+    # The EOF is in-band, a last segment holding the same bytes is taken for it,
+    # only --wire 2 types its packets. The digest form is only accepted from a
+    # server asked for one, so a plain transfer has no more lookalikes than b"EOF"
+    if data == b"EOF":
+        return True
+    return digest and len(data) == 40 and data.startswith(b"EOF md5=") and is_hex_digest(data[8:])
+
+def is_hex_digest(data):
+    # Lowercase hex, as hexdigest() writes it
+    return all(byte in b"0123456789abcdef" for byte in data)
+
+def get_eof_digest(data):
+    return data[8:].decode() if len(data) == 40 else None
+
+def make_parity_header(block_start, k, r, index, symbol, checksum=None):
+    # Seq header of the block start with the parity flag, then k, r and the parity
+    # index, and the checksum of all of them and the symbol like for a data packet
+    header = make_header(block_start)
+    header = bytes([header[0] | PARITY_FLAG]) + header[1:] + bytes([k, r, index])
+    if checksum is not None:
+        return add_checksum(header, symbol, checksum)
+    return header
+
+def is_parity_packet(packet):
+    return bool(packet[0] & PARITY_FLAG)
+
+def parse_parity_packet(packet):
+    flags = packet[0]
+    seq_len = flags & SEQ_LENGTH_MASK
+    block_start = int.from_bytes(packet[1:1 + seq_len], byteorder='big', signed=False)
+    k, r, index = packet[1 + seq_len:4 + seq_len]
+    offset = 4 + seq_len + (4 if flags & CHECKSUM_FLAG else 0)
+    return block_start, k, r, index, packet[offset:]
+
+def make_ack(ack_num, sack_blocks=(), echo=None):
+    # Cumulative ACK followed by (start, end) SACK ranges, `end` is exclusive.
+    # `echo` is the (send timestamp, receive timestamp) of the newest packet
+    if echo is None:
+        segment = ack_num.to_bytes(4, byteorder='big')
+    else:
+        segment = (ack_num | ACK_TIMESTAMP_FLAG).to_bytes(4, byteorder='big')
+        segment += echo[0].to_bytes(4, byteorder='big') + echo[1].to_bytes(4, byteorder='big')
+    for start, end in sack_blocks:
+        segment += start.to_bytes(4, byteorder='big') + end.to_bytes(4, byteorder='big')
+    return segment
+
+def parse_ack(segment):
+    ack_num, sack_blocks, _ = parse_timestamped_ack(segment)
+    return ack_num, sack_blocks
+
+def parse_timestamped_ack(segment):
+    # The first 4 bytes are always the cumulative ACK, a bare 4-byte ACK has no SACK blocks
+    ack_num = int.from_bytes(segment[0:4], byteorder='big')
+    echo = None
+    offset = 4
+    if ack_num & ACK_TIMESTAMP_FLAG:
+        ack_num &= ~ACK_TIMESTAMP_FLAG
+        echo = (
+            int.from_bytes(segment[4:8], byteorder='big'),
+            int.from_bytes(segment[8:12], byteorder='big'),
+        )
+        offset = 12
+    sack_blocks = []
+    for i in range(offset, len(segment) - 7, 8):
+        start = int.from_bytes(segment[i:i + 4], byteorder='big')
+        end = int.from_bytes(segment[i + 4:i + 8], byteorder='big')
+        sack_blocks.append((start, end))
+    return ack_num, sack_blocks, echo
+
+def make_request(command, options=None):
+    # The command is followed by space separated key=value options, a bare key is a flag
+    tokens = [command]
+    for key, value in (options or {}).items():
+        tokens.append(key if value is True else f"{key}={value}")
+    return " ".join(tokens).encode()
+
+def parse_request(request):
+    tokens = request.decode(errors="replace").split()
+    options = {}
+    for token in tokens[1:]:
+        key, sep, value = token.partition("=")
+        options[key] = value if sep else True
+    command = tokens[0] if tokens else ""
+    return command, options
+
+def make_reply(options):
+    return make_request("OK", options)
+
+def parse_reply(packet):
+    # Data packets start with the seq length byte, so they never look like a reply
+    if not packet.startswith(b"OK"):
+        return None
+    _, options = parse_request(packet)
+    return options
+
+def make_error(reason):
+    # Refusal of a request, `reason` is a single word such as not_found
+    return make_request("ERR", {"reason": reason})
+
+def parse_error(packet):
+    # Reason of a refusal, None for any other packet
+    if not packet.startswith(b"ERR"):
+        return None
+    _, options = parse_request(packet)
+    return options.get("reason", "")
@@ -0,0 +1,214 @@
+import struct
+from utils import (
+    make_header,
+    parse_timestamped_packet,
+    make_ack,
+    parse_timestamped_ack,
+    make_request,
+    parse_request,
+    make_parity_header,
+    is_parity_packet,
+    parse_parity_packet,
+    add_checksum,
+    verify_checksum,
+    make_eof,
+    is_eof,
+    get_eof_digest,
+)
+
+# Packet types, CORRUPT is only returned by parse_packet
+CORRUPT = 0
+DATA = 1
+ACK = 2
+EOF = 3
+GET = 4
+PARITY = 5
+
+# First byte of every v2 packet, no text request and no v1 ACK in practice starts with it
+MAGIC = 0xD7
+VERSION = 2
+
+# Header flags
+FLAG_TIMESTAMP = 0x1
+FLAG_CHECKSUM = 0x2
+# An ACK echoing the timestamp of the newest data packet
+FLAG_ECHO = 0x4
+
+# magic, version, type, flags, seq, payload length, timestamp, checksum
+HEADER = struct.Struct("!BBBBQHII")
+# The checksum covers the header up to the checksum field and the payload
+CHECKED_SIZE = HEADER.size - 4
+# Receive timestamp of an echoing ACK, the echoed send timestamp is in the header
+ECHO = struct.Struct("!I")
+SACK_BLOCK = struct.Struct("!QQ")
+# k, r and index in front of the parity symbol
+PARITY_FIELDS = struct.Struct("!BBB")
+
+
+class WireV1:
+    """
+    The original format: variable length seq, flags in the seq length byte, ACKs
+    as a 4-byte int and the EOF signalled by its payload.
+    """
+
+    VERSION = 1
+
+    def make_data_header(self, seq, payload, timestamp=None, checksum=None):
+        header = make_header(seq, timestamp)
+        if checksum is not None:
+            return add_checksum(header, payload, checksum)
+        return header
+
+    def make_eof(self, seq, digest=None, timestamp=None, checksum=None):
+        eof = make_eof(digest)
+        return self.make_data_header(seq, eof, timestamp, checksum) + eof
+
+    def make_parity_header(self, block_start, k, r, index, symbol, checksum=None):
+        return make_parity_header(block_start, k, r, index, symbol, checksum)
+
+    def parse_packet(self, packet, checksum=None, digest=False):
+        """
+        Returns (type, seq, payload, timestamp). The payload of a PARITY packet is
+        (k, r, index, symbol), the one of an EOF the file digest (None without).
+        `digest` tells whether the EOF may carry a digest, see is_eof.
+        """
+        # Checked first, a corrupted flag must not make a data packet look like parity
+        if not verify_checksum(packet, checksum):
+            return CORRUPT, None, None, None
+        if is_parity_packet(packet):
+            block_start, k, r, index, symbol = parse_parity_packet(packet)
+            return PARITY, block_start, (k, r, index, symbol), None
+        seq, data, timestamp = parse_timestamped_packet(packet)
+        if is_eof(data, digest):
+            return EOF, seq, get_eof_digest(data), timestamp
+        return DATA, seq, data, timestamp
+
+    def make_ack(self, ack_num, sack_blocks=(), echo=None):
+        return make_ack(ack_num, sack_blocks, echo)
+
+    def parse_ack(self, packet):
+        # (ack_num, sack_blocks, echo), a v1 ACK cannot be told from other packets
+        return parse_timestamped_ack(packet)
+
+    def make_get(self, options):
+        return make_request("GET", options)
+
+
+class WireV2:
+    """
+    Fixed 22-byte header packed with one precompiled struct: explicit packet
+    type, flags, 64-bit seq and payload length, timestamp and checksum fields
+    that are always present. Payloads are returned as memoryview slices of the
+    received packet, never copied.
+    """
+
+    VERSION = 2
+
+    def make_header(self, packet_type, seq, payload, flags=0, timestamp=0, checksum=None):
+        if checksum is None:
+            return HEADER.pack(MAGIC, VERSION, packet_type, flags, seq, len(payload), timestamp, 0)
+        flags |= FLAG_CHECKSUM
+        header = HEADER.pack(MAGIC, VERSION, packet_type, flags, seq, len(payload), timestamp, 0)
+        value = checksum(payload, checksum(header[:CHECKED_SIZE]))
+        return header[:CHECKED_SIZE] + value.to_bytes(4, byteorder="big")
+
+    def make_data_header(self, seq, payload, timestamp=None, checksum=None):
+        flags = 0 if timestamp is None else FLAG_TIMESTAMP
+        if checksum is None:
+            # Hot path, one pack call
+            return HEADER.pack(MAGIC, VERSION, DATA, flags, seq, len(payload), timestamp or 0, 0)
+        return self.make_header(DATA, seq, payload, flags, timestamp or 0, checksum)
+
+    def make_eof(self, seq, digest=None, timestamp=None, checksum=None):
+        # The payload is the hex digest of the whole file, empty without one
+        payload = b"" if digest is None else digest.encode()
+        flags = 0 if timestamp is None else FLAG_TIMESTAMP
+        return self.make_header(EOF, seq, payload, flags, timestamp or 0, checksum) + payload
+
+    def make_parity_header(self, block_start, k, r, index, symbol, checksum=None):
+        # The parity fields are the start of the payload, the symbol follows them
+        fields = PARITY_FIELDS.pack(k, r, index)
+        if checksum is None:
+            length = PARITY_FIELDS.size + len(symbol)
+            return HEADER.pack(MAGIC, VERSION, PARITY, 0, block_start, length, 0, 0) + fields
+        # The checksum covers the whole payload, fields and symbol together
+        return self.make_header(PARITY, block_start, fields + symbol, checksum=checksum) + fields
+
+    def parse_packet(self, packet, checksum=None, digest=False):
+        """
+        Returns (type, seq, payload, timestamp) like WireV1.parse_packet. The
+        EOF has its own type, `digest` is not needed to tell it from data.
+        """
+        view = memoryview(packet)
+        if len(view) < HEADER.size or view[0] != MAGIC:
+            return CORRUPT, None, None, None
+        _, _, packet_type, flags, seq, length, timestamp, value = HEADER.unpack_from(view)
+        end = HEADER.size + length
+        if len(view) < end:
+            return CORRUPT, None, None, None
+        payload = view[HEADER.size : end]
+        # Checked before the type, a corrupted type must not make data look like parity
+        if checksum is not None and (
+            not flags & FLAG_CHECKSUM
+            or checksum(payload, checksum(view[:CHECKED_SIZE])) != value
+        ):
+            return CORRUPT, None, None, None
+        if packet_type == PARITY:
+            k, r, index = PARITY_FIELDS.unpack_from(view, HEADER.size)
+            return PARITY, seq, (k, r, index, payload[PARITY_FIELDS.size :]), None
+        if not flags & FLAG_TIMESTAMP:
+            timestamp = None
+        if packet_type == EOF:
+            return EOF, seq, bytes(payload).decode() if length else None, timestamp
+        return packet_type, seq, payload, timestamp
+
+    def make_ack(self, ack_num, sack_blocks=(), echo=None):
+        payload = b"".join(SACK_BLOCK.pack(start, end) for start, end in sack_blocks)
+        if echo is None:
+            return self.make_header(ACK, ack_num, payload) + payload
+        payload = ECHO.pack(echo[1]) + payload
+        return self.make_header(ACK, ack_num, payload, FLAG_ECHO, echo[0]) + payload
+
+    def parse_ack(self, packet):
+        # (ack_num, sack_blocks, echo), None for anything that is not an ACK
+        view = memoryview(packet)
+        if len(view) < HEADER.size or view[0] != MAGIC:
+            return None
+        _, _, packet_type, flags, ack_num, length, timestamp, _ = HEADER.unpack_from(view)
+        if packet_type != ACK:
+            return None
+        offset = HEADER.size
+        echo = None
+        if flags & FLAG_ECHO:
+            echo = (timestamp, ECHO.unpack_from(view, offset)[0])
+            offset += ECHO.size
+        sack_blocks = list(SACK_BLOCK.iter_unpack(view[offset : HEADER.size + length]))
+        return ack_num, sack_blocks, echo
+
+    def make_get(self, options):
+        # The options are the same text as in a v1 GET
+        payload = make_request("GET", options)
+        return self.make_header(GET, 0, payload) + payload
+
+
+WIRE_V1 = WireV1()
+WIRE_V2 = WireV2()
+WIRES = {1: WIRE_V1, 2: WIRE_V2}
+
+
+def parse_request_packet(packet):
+    # (command, options, wire) of a v1 text request or a v2 GET
+    if len(packet) >= HEADER.size and packet[0] == MAGIC:
+        _, _, packet_type, _, _, length, _, _ = HEADER.unpack_from(packet)
+        if packet_type == GET:
+            command, options = parse_request(packet[HEADER.size : HEADER.size + length])
+            return command, options, WIRE_V2
+        return "", {}, WIRE_V2
+    command, options = parse_request(packet)
+    return command, options, WIRE_V1
+
+
+def is_get(packet):
+    return packet.startswith(b"GET") or (
+        len(packet) >= HEADER.size and packet[0] == MAGIC and packet[2] == GET
+    )